@@ -2,15 +2,99 @@
 Sistema de recarga de configuración mediante archivo de señales.
 Permite recargar la configuración del bot sin reiniciar el proceso.
 """
+import asyncio
+import copy
+import hashlib
 import json
+import logging
 import os
 from datetime import datetime
+from typing import Any, Iterator, Tuple
+
+import orjson
 from logger_config import get_logger
+from llm_client import LLMClient
+from mood_manager import MoodManager
+from news_manager import NewsManager
+from tts_client import TTSClient
+
+try:
+    from inotify_simple import INotify, flags as inotify_flags
+except ImportError:  # inotify solo está disponible en Linux
+    INotify = None
 
 logger = get_logger('telegram')
 
 RELOAD_SIGNAL_FILE = '.reload_signal'
 
+BANNER = "=" * 60
+
+# Claves cuyo cambio obliga a reconstruir cada componente
+_LLM_CLIENT_KEYS = ("api_key", "api_url", "max_concurrent_requests")
+_LLM_PARAM_KEYS = ("model", "max_tokens", "temperature", "system_prompt", "response_cache_size",
+                   "max_retries")
+_MOOD_WATCHED_KEYS = ("weather_api_key", "location")
+_TTS_WATCHED_KEYS = ("enabled", "model", "speaker", "preamble", "temperature", "frequency_percent")
+
+
+# Valores que no deben aparecer en los logs
+_SENSITIVE_PATHS = {
+    ("telegram", "bot_token"),
+    ("llm", "api_key"),
+    ("mood", "weather_api_key"),
+    ("web", "admin_password"),
+}
+
+
+def _section_changed(old_section: dict, new_section: dict, keys: tuple) -> bool:
+    """Indica si alguna de las claves vigiladas cambió entre dos secciones."""
+    return any(new_section.get(k) != old_section.get(k) for k in keys)
+
+
+def _diff_config(old: Any, new: Any, path: Tuple[str, ...] = ()) -> Iterator[Tuple[Tuple[str, ...], Any, Any]]:
+    """
+    Recorre dos configuraciones y genera las hojas que difieren.
+
+    Args:
+        old: Valor anterior (diccionario o valor simple)
+        new: Valor nuevo
+        path: Ruta de claves hasta este punto
+
+    Yields:
+        Tuplas (ruta, valor anterior, valor nuevo)
+    """
+    if old == new:
+        return
+    if isinstance(old, dict) or isinstance(new, dict):
+        # Una sección añadida o eliminada se compara contra una vacía, para
+        # que cada hoja pase por _format_value y se enmascaren los secretos
+        if not isinstance(old, dict):
+            if old is not None:
+                yield path, old, None
+            old = {}
+        if not isinstance(new, dict):
+            if new is not None:
+                yield path, None, new
+            new = {}
+        for key in sorted(old.keys() | new.keys()):
+            yield from _diff_config(old.get(key), new.get(key), path + (key,))
+    else:
+        yield path, old, new
+
+
+def _format_value(path: Tuple[str, ...], value: Any) -> str:
+    """Da formato breve a un valor de configuración para el log de cambios."""
+    if path in _SENSITIVE_PATHS:
+        return "***"
+    if value is None:
+        return "N/A"
+    if isinstance(value, list):
+        return f"[{len(value)} elementos]"
+    if isinstance(value, str) and (len(value) > 100 or '\n' in value):
+        preview = value[:100].replace('\n', ' ')
+        return f"'{preview}...' ({len(value)} caracteres)"
+    return repr(value) if isinstance(value, str) else str(value)
+
 
 class ConfigReloader:
     """Gestiona la recarga de configuración del bot."""
@@ -25,6 +109,70 @@ class ConfigReloader:
         self.config_file = config_file
         self.last_reload = datetime.now()
 
+        # Caché de la última configuración parseada: ((mtime_ns, tamaño), hash, config)
+        self._parse_cache = None
+        # Hash del contenido de la última configuración aplicada
+        self._last_content_hash = None
+
+        # Vigilar el directorio con inotify para no hacer un stat en cada chequeo
+        self._ino = None
+        if INotify is not None:
+            try:
+                self._ino = INotify()
+                self._ino.add_watch(
+                    os.path.dirname(os.path.abspath(RELOAD_SIGNAL_FILE)),
+                    inotify_flags.CLOSE_WRITE | inotify_flags.MOVED_TO | inotify_flags.CREATE
+                )
+                logger.debug("Vigilancia inotify de la señal de recarga activada")
+            except OSError as e:
+                logger.warning(f"No se pudo activar inotify, se usará sondeo: {e}")
+                self._ino = None
+
+        # Una señal creada antes de arrancar no genera eventos
+        self._signal_pending = os.path.exists(RELOAD_SIGNAL_FILE)
+
+    def _signal_may_exist(self) -> bool:
+        """
+        Indica si puede haber una señal de recarga desde el último chequeo.
+
+        Returns:
+            True si hay que intentar abrir el archivo de señal
+        """
+        if self._ino is None:
+            return True
+
+        signal_name = os.path.basename(RELOAD_SIGNAL_FILE)
+        for event in self._ino.read(timeout=0):
+            if event.name == signal_name:
+                self._signal_pending = True
+
+        pending = self._signal_pending
+        self._signal_pending = False
+        return pending
+
+    @property
+    def uses_inotify(self) -> bool:
+        """Indica si la señal de recarga se vigila con inotify."""
+        return self._ino is not None
+
+    async def wait_reload(self):
+        """
+        Espera, sin sondear, a que llegue una señal de recarga.
+
+        Requiere inotify: registra el descriptor en el bucle de eventos y
+        vuelve cuando check_reload_signal() detecta la señal.
+        """
+        loop = asyncio.get_running_loop()
+        fd = self._ino.fileno()
+
+        while not self.check_reload_signal():
+            readable = loop.create_future()
+            loop.add_reader(fd, lambda: readable.done() or readable.set_result(None))
+            try:
+                await readable
+            finally:
+                loop.remove_reader(fd)
+
     def check_reload_signal(self) -> bool:
         """
         Verifica si existe una señal de recarga.
@@ -32,28 +180,62 @@ class ConfigReloader:
         Returns:
             True si hay señal de recarga, False en caso contrario
         """
-        if os.path.exists(RELOAD_SIGNAL_FILE):
-            logger.info("Señal de recarga detectada")
-            try:
-                # Leer el archivo de señal para obtener información
-                with open(RELOAD_SIGNAL_FILE, 'r') as f:
-                    signal_data = json.load(f)
-                    logger.info(f"Recarga solicitada: {signal_data.get('reason', 'Sin razón especificada')}")
-                    logger.info(f"Solicitada por: {signal_data.get('source', 'Desconocido')}")
-            except Exception as e:
-                logger.warning(f"No se pudo leer información del archivo de señal: {e}")
-
-            # Eliminar el archivo de señal
-            try:
-                os.remove(RELOAD_SIGNAL_FILE)
-                logger.debug("Archivo de señal eliminado")
-            except Exception as e:
-                logger.error(f"Error al eliminar archivo de señal: {e}")
+        if not self._signal_may_exist():
+            return False
 
-            return True
-        return False
+        # Abrir directamente: si no existe basta con una sola llamada al sistema
+        try:
+            fd = os.open(RELOAD_SIGNAL_FILE, os.O_RDONLY)
+        except FileNotFoundError:
+            return False
 
-    def reload_config(self, bot_instance):
+        logger.info("Señal de recarga detectada")
+        try:
+            # Leer el archivo de señal para obtener información
+            with os.fdopen(fd, 'rb') as f:
+                signal_data = orjson.loads(f.read())
+                logger.info(f"Recarga solicitada: {signal_data.get('reason', 'Sin razón especificada')}")
+                logger.info(f"Solicitada por: {signal_data.get('source', 'Desconocido')}")
+        except Exception as e:
+            logger.warning(f"No se pudo leer información del archivo de señal: {e}")
+
+        # Eliminar el archivo de señal
+        try:
+            os.unlink(RELOAD_SIGNAL_FILE)
+            logger.debug("Archivo de señal eliminado")
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.error(f"Error al eliminar archivo de señal: {e}")
+
+        return True
+
+    def _load_config(self) -> Tuple[bytes, dict]:
+        """
+        Carga el archivo de configuración, reutilizando el último parseo
+        si el archivo no ha cambiado (mismo mtime y tamaño).
+
+        Returns:
+            Tupla (hash del contenido, configuración parseada). La configuración
+            es la copia en caché, por lo que el llamador no debe modificarla.
+        """
+        st = os.stat(self.config_file)
+        key = (st.st_mtime_ns, st.st_size)
+
+        if self._parse_cache and self._parse_cache[0] == key:
+            logger.debug("Configuración sin cambios en disco, reutilizando caché")
+            return self._parse_cache[1], self._parse_cache[2]
+
+        with open(self.config_file, 'rb') as f:
+            data = f.read()
+
+        content_hash = hashlib.blake2b(data, digest_size=16).digest()
+        config = orjson.loads(data)
+
+        self._parse_cache = (key, content_hash, config)
+        return content_hash, config
+
+    async def reload_config(self, bot_instance):
         """
         Recarga la configuración del bot.
 
@@ -61,98 +243,144 @@ class ConfigReloader:
             bot_instance: Instancia de CompanionBot
         """
         try:
-            logger.info("="*60)
-            logger.info("Iniciando recarga de configuración...")
-            logger.info("="*60)
+            content_hash, cached_config = self._load_config()
+            if content_hash == self._last_content_hash:
+                logger.info("Señal de recarga recibida, pero la configuración no ha cambiado")
+                return
+
+            logger.info(f"{BANNER}\nIniciando recarga de configuración...\n{BANNER}")
 
             # Cargar nueva configuración
-            with open(self.config_file, 'r', encoding='utf-8') as f:
-                new_config = json.load(f)
+            new_config = copy.deepcopy(cached_config)
 
             logger.info("Nueva configuración cargada desde archivo")
 
-            # Actualizar configuración en la instancia del bot
             old_config = bot_instance.config
-            bot_instance.config = new_config
 
-            # Reconstruir el cliente LLM con nueva configuración
-            from llm_client import LLMClient
-            bot_instance.llm_client = LLMClient(
-                api_key=new_config["llm"]["api_key"],
-                model=new_config["llm"]["model"],
-                max_tokens=new_config["llm"]["max_tokens"],
-                temperature=new_config["llm"]["temperature"],
-                system_prompt=new_config["llm"]["system_prompt"],
-                api_url=new_config["llm"]["api_url"]
-            )
-            logger.info("Cliente LLM reconstruido con nueva configuración")
-            logger.info(f"  - Modelo: {new_config['llm']['model']}")
-            logger.info(f"  - Temperature: {new_config['llm']['temperature']}")
-            logger.info(f"  - Max tokens: {new_config['llm']['max_tokens']}")
-            logger.info(f"  - System prompt (longitud): {len(new_config['llm']['system_prompt'])} caracteres")
-            logger.debug(f"  - System prompt (primeros 200 caracteres): '{new_config['llm']['system_prompt'][:200]}...'")
+            # Componentes a reconstruir: atributo -> constructor. Los valores
+            # que no requieren construcción van directamente a `staged`.
+            builders = {}
+            staged = {}
+
+            llm_config = new_config["llm"]
+            old_llm_config = old_config.get("llm", {})
+            update_llm_params = False
+            if _section_changed(old_llm_config, llm_config, _LLM_CLIENT_KEYS):
+                builders["llm_client"] = lambda: LLMClient(
+                    api_key=llm_config["api_key"],
+                    model=llm_config["model"],
+                    max_tokens=llm_config["max_tokens"],
+                    temperature=llm_config["temperature"],
+                    system_prompt=llm_config["system_prompt"],
+                    api_url=llm_config["api_url"],
+                    cache_size=llm_config.get("response_cache_size", 128),
+                    max_concurrency=llm_config.get("max_concurrent_requests", 4),
+                    max_retries=llm_config.get("max_retries", 3)
+                )
+            elif _section_changed(old_llm_config, llm_config, _LLM_PARAM_KEYS):
+                # Solo cambian parámetros de generación: no hace falta otro cliente
+                update_llm_params = True
 
             # Actualizar gestor de noticias si cambió
             rss_feeds = new_config.get("news", {}).get("rss_feeds", [])
             if rss_feeds != old_config.get("news", {}).get("rss_feeds", []):
                 if rss_feeds:
-                    from news_manager import NewsManager
                     storage_file = new_config.get("news", {}).get("cache_file", "./news_cache.json")
-                    bot_instance.news_manager = NewsManager(rss_feeds, storage_file)
-                    logger.info(f"Gestor de noticias actualizado con {len(rss_feeds)} feeds")
+                    builders["news_manager"] = lambda: NewsManager(rss_feeds, storage_file)
                 else:
-                    bot_instance.news_manager = None
-                    logger.info("Gestor de noticias deshabilitado")
+                    staged["news_manager"] = None
 
             # Actualizar gestor de mood si cambió
             mood_config = new_config.get("mood", {})
             old_mood_config = old_config.get("mood", {})
-            if (mood_config.get("weather_api_key") != old_mood_config.get("weather_api_key") or
-                mood_config.get("location") != old_mood_config.get("location")):
-                from mood_manager import MoodManager
+            if _section_changed(old_mood_config, mood_config, _MOOD_WATCHED_KEYS):
                 weather_api_key = mood_config.get("weather_api_key")
                 location = mood_config.get("location", "Madrid,ES")
-                bot_instance.mood_manager = MoodManager(weather_api_key, location)
-                logger.info(f"Gestor de mood actualizado (ubicación: {location})")
+                builders["mood_manager"] = lambda: MoodManager(weather_api_key, location)
 
             # Actualizar cliente TTS si cambió o se habilitó/deshabilitó
             tts_config = new_config.get("tts", {})
             old_tts_config = old_config.get("tts", {})
-
-            # Verificar si cambió algún parámetro de TTS
-            tts_changed = (
-                tts_config.get("enabled") != old_tts_config.get("enabled") or
-                tts_config.get("model") != old_tts_config.get("model") or
-                tts_config.get("speaker") != old_tts_config.get("speaker") or
-                tts_config.get("preamble") != old_tts_config.get("preamble") or
-                tts_config.get("temperature") != old_tts_config.get("temperature") or
-                tts_config.get("frequency_percent") != old_tts_config.get("frequency_percent")
-            )
-
+            tts_changed = _section_changed(old_tts_config, tts_config, _TTS_WATCHED_KEYS)
             if tts_changed:
                 logger.info("Detectados cambios en configuración de TTS")
                 if tts_config.get("enabled", False):
-                    from tts_client import TTSClient
-                    bot_instance.tts_client = TTSClient(
-                        api_key=new_config["llm"]["api_key"],
-                        model=tts_config.get("model", new_config["llm"]["model"]),
+                    builders["tts_client"] = lambda: TTSClient(
+                        api_key=llm_config["api_key"],
+                        model=tts_config.get("model", llm_config["model"]),
                         speaker=tts_config.get("speaker", "Leda"),
                         preamble=tts_config.get("preamble", ""),
                         temperature=tts_config.get("temperature", 0.5),
                         audio_dir=tts_config.get("audio_dir", "./audio_outputs")
                     )
-                    bot_instance.tts_frequency = tts_config.get("frequency_percent", 30)
+                    staged["tts_frequency"] = tts_config.get("frequency_percent", 30)
+                else:
+                    staged["tts_client"] = None
+                    staged["tts_frequency"] = 0
+
+            # Actualizar horario de "no molestar" si cambió
+            old_quiet_hours = old_config.get("proactive", {}).get("quiet_hours", {})
+            if new_config.get("proactive", {}).get("quiet_hours", {}) != old_quiet_hours:
+                staged["quiet_hours"] = bot_instance.parse_quiet_hours(new_config)
+
+            # Construir los componentes en paralelo fuera del bucle de eventos;
+            # si alguno falla, la excepción se propaga antes de tocar el bot.
+            # Lo que sigue se aplica ya en el bucle, que usa esos objetos.
+            if builders:
+                loop = asyncio.get_running_loop()
+                results = await asyncio.gather(
+                    *(loop.run_in_executor(None, build) for build in builders.values())
+                )
+                staged.update(zip(builders, results))
+
+            # Actualizar los parámetros del cliente LLM antes de aplicar nada
+            # más: si falla, el bot se queda entero con la configuración anterior
+            if update_llm_params:
+                bot_instance.llm_client.update_params(
+                    model=llm_config["model"],
+                    max_tokens=llm_config["max_tokens"],
+                    temperature=llm_config["temperature"],
+                    system_prompt=llm_config["system_prompt"],
+                    cache_size=llm_config.get("response_cache_size", 128),
+                    max_retries=llm_config.get("max_retries", 3)
+                )
+
+            # Aplicar todos los cambios de una vez
+            bot_instance.config = new_config
+            for attr, value in staged.items():
+                setattr(bot_instance, attr, value)
+
+            if "llm_client" in builders:
+                logger.info("Cliente LLM reconstruido con nueva configuración")
+            elif update_llm_params:
+                logger.info("Parámetros del cliente LLM actualizados")
+            else:
+                logger.info("Configuración LLM sin cambios, se mantiene el cliente actual")
+            logger.info("  - Modelo: %s\n  - Temperature: %s\n  - Max tokens: %s\n  - System prompt (longitud): %d caracteres",
+                        llm_config['model'], llm_config['temperature'], llm_config['max_tokens'],
+                        len(llm_config['system_prompt']))
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("  - System prompt (primeros 200 caracteres): '%s...'", llm_config['system_prompt'][:200])
+
+            if "news_manager" in staged:
+                if staged["news_manager"]:
+                    logger.info(f"Gestor de noticias actualizado con {len(rss_feeds)} feeds")
+                else:
+                    logger.info("Gestor de noticias deshabilitado")
+
+            if "mood_manager" in staged:
+                logger.info(f"Gestor de mood actualizado (ubicación: {location})")
+
+            if tts_changed:
+                if staged["tts_client"]:
                     logger.info(f"Cliente TTS reconstruido (speaker: {tts_config.get('speaker', 'Leda')}, temperature: {tts_config.get('temperature', 0.5)}, frecuencia: {bot_instance.tts_frequency}%)")
                 else:
-                    bot_instance.tts_client = None
-                    bot_instance.tts_frequency = 0
                     logger.info("Cliente TTS deshabilitado")
 
             self.last_reload = datetime.now()
+            self._last_content_hash = content_hash
 
-            logger.info("="*60)
-            logger.info("✅ Configuración recargada exitosamente")
-            logger.info("="*60)
+            logger.info(f"{BANNER}\n✅ Configuración recargada exitosamente\n{BANNER}")
 
             # Log de cambios importantes
             self._log_config_changes(old_config, new_config)
@@ -168,71 +396,17 @@ class ConfigReloader:
             old_config: Configuración anterior
             new_config: Nueva configuración
         """
-        changes = []
-
-        # Cambios en LLM
-        if old_config["llm"].get("model") != new_config["llm"].get("model"):
-            changes.append(f"  - Modelo LLM: {old_config['llm'].get('model')} → {new_config['llm'].get('model')}")
-
-        if old_config["llm"]["temperature"] != new_config["llm"]["temperature"]:
-            changes.append(f"  - Temperatura LLM: {old_config['llm']['temperature']} → {new_config['llm']['temperature']}")
-
-        if old_config["llm"]["max_tokens"] != new_config["llm"]["max_tokens"]:
-            changes.append(f"  - Max tokens: {old_config['llm']['max_tokens']} → {new_config['llm']['max_tokens']}")
-
-        if old_config["llm"]["system_prompt"] != new_config["llm"]["system_prompt"]:
-            old_prompt_preview = old_config['llm']['system_prompt'][:100].replace('\n', ' ')
-            new_prompt_preview = new_config['llm']['system_prompt'][:100].replace('\n', ' ')
-            changes.append(f"  - System prompt modificado:")
-            changes.append(f"    * Longitud: {len(old_config['llm']['system_prompt'])} → {len(new_config['llm']['system_prompt'])} caracteres")
-            changes.append(f"    * Anterior: '{old_prompt_preview}...'")
-            changes.append(f"    * Nuevo: '{new_prompt_preview}...'")
-
-        # Cambios en proactive
-        if old_config["proactive"]["inactivity_minutes"] != new_config["proactive"]["inactivity_minutes"]:
-            changes.append(f"  - Minutos de inactividad: {old_config['proactive']['inactivity_minutes']} → {new_config['proactive']['inactivity_minutes']}")
-
-        # Cambios en quiet hours
-        old_quiet = old_config.get("proactive", {}).get("quiet_hours", {})
-        new_quiet = new_config.get("proactive", {}).get("quiet_hours", {})
-        if old_quiet != new_quiet:
-            changes.append(f"  - Horario de silencio modificado")
-
-        # Cambios en RSS feeds
-        old_rss = old_config.get("news", {}).get("rss_feeds", [])
-        new_rss = new_config.get("news", {}).get("rss_feeds", [])
-        if old_rss != new_rss:
-            changes.append(f"  - Feeds RSS: {len(old_rss)} → {len(new_rss)}")
-
-        # Cambios en TTS
-        old_tts = old_config.get("tts", {})
-        new_tts = new_config.get("tts", {})
-
-        if old_tts.get("enabled") != new_tts.get("enabled"):
-            changes.append(f"  - TTS habilitado: {old_tts.get('enabled', False)} → {new_tts.get('enabled', False)}")
-
-        if new_tts.get("enabled", False):
-            if old_tts.get("model") != new_tts.get("model"):
-                changes.append(f"  - TTS Modelo: {old_tts.get('model', 'N/A')} → {new_tts.get('model', 'N/A')}")
-
-            if old_tts.get("speaker") != new_tts.get("speaker"):
-                changes.append(f"  - TTS Speaker: {old_tts.get('speaker', 'N/A')} → {new_tts.get('speaker', 'N/A')}")
-
-            if old_tts.get("preamble") != new_tts.get("preamble"):
-                old_preamble = old_tts.get("preamble", "")
-                new_preamble = new_tts.get("preamble", "")
-                changes.append(f"  - TTS Preámbulo: '{old_preamble[:30]}...' → '{new_preamble[:30]}...'")
-
-            if old_tts.get("temperature") != new_tts.get("temperature"):
-                changes.append(f"  - TTS Temperatura: {old_tts.get('temperature', 'N/A')} → {new_tts.get('temperature', 'N/A')}")
+        # Evitar recorrer y formatear las configuraciones si el log está desactivado
+        if not logger.isEnabledFor(logging.INFO):
+            return
 
-            if old_tts.get("frequency_percent") != new_tts.get("frequency_percent"):
-                changes.append(f"  - TTS Frecuencia: {old_tts.get('frequency_percent', 'N/A')}% → {new_tts.get('frequency_percent', 'N/A')}%")
+        changes = [
+            f"  - {'.'.join(path)}: {_format_value(path, old)} → {_format_value(path, new)}"
+            for path, old, new in _diff_config(old_config, new_config)
+        ]
 
         if changes:
-            logger.info("Cambios detectados:")
-            for change in changes:
-                logger.info(change)
+            logger.info("Cambios detectados:\n" + "\n".join(changes))
         else:
             logger.info("No se detectaron cambios significativos")
 
@@ -252,8 +426,11 @@ def create_reload_signal(reason: str = "Configuración actualizada", source: str
     }
 
     try:
-        with open(RELOAD_SIGNAL_FILE, 'w') as f:
+        # Escribir en un temporal y renombrar para que la señal aparezca de forma atómica
+        tmp_file = RELOAD_SIGNAL_FILE + '.tmp'
+        with open(tmp_file, 'w') as f:
             json.dump(signal_data, f, indent=2)
+        os.replace(tmp_file, RELOAD_SIGNAL_FILE)
         logger.info(f"Señal de recarga creada: {reason}")
         return True
     except Exception as e:
@@ -1,55 +1,488 @@
 """
 Gestor de conversaciones para el bot de Telegram.
 Maneja el almacenamiento y recuperación de mensajes por usuario.
+
+Cada usuario se guarda en dos archivos:
+- user_<id>.jsonl: un mensaje por línea, solo se añaden líneas al final
+- user_<id>.meta.json: datos del usuario (nombre, fecha de alta...)
+
+Los archivos antiguos user_<id>.json se siguen leyendo y se migran al
+nuevo formato la primera vez que se escribe en esa conversación.
 """
-import json
+import bisect
+import logging
 import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
-from typing import List, Dict, Optional
+from typing import Deque, List, Dict, Optional
+
+import orjson
+
+logger = logging.getLogger(__name__)
+
+# Tamaño inicial del bloque leído desde el final del archivo en `_tail_lines`
+TAIL_CHUNK_SIZE = 8192
+
+# Hilos usados para leer los archivos de usuarios en `get_all_users`
+USERS_SCAN_WORKERS = 8
+
+# Índice con el resumen de cada usuario (nombre, número de mensajes, último mensaje)
+INDEX_FILE_NAME = "_index.json"
+
+
+def _tail_lines(path: Path, count: int) -> List[bytes]:
+    """
+    Lee las últimas `count` líneas no vacías de un archivo sin cargarlo entero.
+
+    Lee un bloque desde el final y lo duplica hasta tener suficientes líneas
+    o haber llegado al principio del archivo.
+
+    Args:
+        path: Ruta del archivo
+        count: Número de líneas a devolver
+
+    Returns:
+        Lista con las últimas líneas (sin salto de línea), en orden
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        size = os.fstat(fd).st_size
+        window = TAIL_CHUNK_SIZE
+        while True:
+            offset = max(0, size - window)
+            data = os.pread(fd, size - offset, offset)
+            lines = data.splitlines()
+            # Si no se leyó desde el principio, la primera línea puede estar cortada
+            if offset > 0:
+                lines = lines[1:]
+            lines = [line for line in lines if line]
+            if len(lines) >= count or offset == 0:
+                return lines[-count:]
+            window *= 2
+    finally:
+        os.close(fd)
+
+
+def _decode_lines(path: Path, lines: List[bytes]) -> List[Dict]:
+    """
+    Decodifica las líneas de un archivo JSONL, saltando las que no son JSON
+    válido en lugar de perder todo el historial por una línea dañada.
+
+    Args:
+        path: Ruta del archivo (para el aviso)
+        lines: Líneas no vacías, sin salto de línea
+
+    Returns:
+        Lista de mensajes decodificados
+    """
+    messages = []
+    for line in lines:
+        try:
+            messages.append(orjson.loads(line))
+        except orjson.JSONDecodeError:
+            # Normalmente una escritura cortada por una caída del proceso
+            logger.warning("Línea dañada ignorada en %s: %r", path, bytes(line[:80]))
+    return messages
+
+
+def _truncate_torn_tail(path: Path):
+    """
+    Elimina la última línea de un archivo JSONL si quedó a medias (sin salto
+    de línea final), para que el siguiente mensaje empiece en línea nueva.
+
+    Si esa última línea es JSON válido solo le faltaba el salto de línea, y
+    se añade en lugar de borrarla.
+
+    Args:
+        path: Ruta del archivo
+    """
+    fd = os.open(path, os.O_RDWR)
+    try:
+        size = os.fstat(fd).st_size
+        if size == 0 or os.pread(fd, 1, size - 1) == b"\n":
+            return
+
+        # Buscar el último salto de línea leyendo bloques desde el final
+        window = TAIL_CHUNK_SIZE
+        while True:
+            offset = max(0, size - window)
+            data = os.pread(fd, size - offset, offset)
+            newline = data.rfind(b"\n")
+            if newline >= 0 or offset == 0:
+                break
+            window *= 2
+        line_start = offset + newline + 1
+        tail = os.pread(fd, size - line_start, line_start)
+
+        try:
+            orjson.loads(tail)
+        except orjson.JSONDecodeError:
+            logger.warning("Escritura incompleta al final de %s (%d bytes), se descarta",
+                           path, size - line_start)
+            os.ftruncate(fd, line_start)
+        else:
+            os.pwrite(fd, b"\n", size)
+    finally:
+        os.close(fd)
+
+
+def _read_file(path: Path) -> bytearray:
+    """
+    Lee un archivo completo en un único búfer preasignado.
+
+    orjson acepta bytearray directamente, así que no hace falta ninguna
+    copia intermedia entre la lectura y el parseo.
+
+    Args:
+        path: Ruta del archivo
+
+    Returns:
+        Contenido del archivo
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        size = os.fstat(fd).st_size
+        buf = bytearray(size)
+        view = memoryview(buf)
+        read = 0
+        while read < size:
+            n = os.readv(fd, [view[read:]])
+            if n == 0:
+                break
+            read += n
+        view.release()
+        # El archivo pudo encoger entre fstat y la lectura
+        del buf[read:]
+        return buf
+    finally:
+        os.close(fd)
+
+
+# Último segundo formateado por `_now_iso`: (segundo epoch, prefijo ISO)
+_iso_second_cache = (None, "")
+
+
+def _now_iso() -> str:
+    """
+    Devuelve la hora local actual en ISO 8601 con microsegundos.
+
+    Equivale a datetime.now().isoformat(), pero solo formatea la fecha y
+    hora una vez por segundo y añade los microsegundos a mano.
+    """
+    global _iso_second_cache
+    seconds, nanos = divmod(time.time_ns(), 1_000_000_000)
+    cached_seconds, prefix = _iso_second_cache
+    if seconds != cached_seconds:
+        prefix = datetime.fromtimestamp(seconds).isoformat()
+        _iso_second_cache = (seconds, prefix)
+    return f"{prefix}.{nanos // 1000:06d}"
+
+
+def _write_all(fd: int, data: bytes):
+    """Escribe todos los bytes en el descriptor (os.write puede escribir menos)."""
+    view = memoryview(data)
+    while view:
+        written = os.write(fd, view)
+        view = view[written:]
+
+
+def _fsync_path(path: Path):
+    """Fuerza a disco el contenido ya escrito de un archivo."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _write_file_atomic(path: Path, data: bytes, sync: bool = True):
+    """
+    Escribe un archivo de forma atómica: temporal + fsync + rename.
+
+    Args:
+        path: Ruta final del archivo
+        data: Contenido completo del archivo
+        sync: Si es False se omite el fsync (para datos que se pueden reconstruir)
+    """
+    tmp_path = path.with_name(path.name + ".tmp")
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        _write_all(fd, data)
+        if sync:
+            os.fsync(fd)
+    finally:
+        os.close(fd)
+    os.replace(tmp_path, path)
 
 
 class ConversationManager:
     """Gestiona las conversaciones de usuarios individuales."""
 
-    def __init__(self, conversations_dir: str, max_context_messages: int = 20):
+    def __init__(self, conversations_dir: str, max_context_messages: int = 20,
+                 flush_every: int = 10, max_context_chars: int = 0):
         """
         Inicializa el gestor de conversaciones.
 
         Args:
             conversations_dir: Directorio donde se guardan las conversaciones
             max_context_messages: Número máximo de mensajes a mantener en contexto
+            flush_every: Mensajes pendientes por usuario tras los que se escribe a disco
+            max_context_chars: Caracteres máximos del contexto enviado al LLM (0 sin límite)
         """
         self.conversations_dir = Path(conversations_dir)
         self.conversations_dir.mkdir(parents=True, exist_ok=True)
         self.max_context_messages = max_context_messages
-
-    def _get_user_file(self, user_id: int) -> Path:
-        """Obtiene la ruta del archivo de conversación de un usuario."""
+        self.flush_every = max(1, flush_every)
+        self.max_context_chars = max_context_chars
+
+        # Estado de los usuarios a los que se ha escrito desde este proceso.
+        # Un proceso que únicamente lee (la interfaz web) siempre ve el disco.
+        self._meta: Dict[int, Dict] = {}
+        self._pending: Dict[int, List[Dict]] = {}
+        self._meta_dirty: set = set()
+        # Últimos mensajes de cada usuario, para servir get_context sin leer disco
+        self._recent: Dict[int, Deque[Dict]] = {}
+
+        # Índice de usuarios; solo se carga y mantiene en el proceso que escribe
+        self._index_file = self.conversations_dir / INDEX_FILE_NAME
+        self._index: Optional[Dict[str, Dict]] = None
+        self._index_dirty = False
+
+        # Archivos de mensajes escritos pero aún no forzados a disco. El fsync
+        # se hace en `sync`, fuera del bucle de eventos, y no en cada escritura
+        self._unsynced: set = set()
+        self._sync_lock = threading.Lock()
+
+    def _get_messages_file(self, user_id: int) -> Path:
+        """Obtiene la ruta del archivo de mensajes de un usuario."""
+        return self.conversations_dir / f"user_{user_id}.jsonl"
+
+    def _get_meta_file(self, user_id: int) -> Path:
+        """Obtiene la ruta del archivo de datos de un usuario."""
+        return self.conversations_dir / f"user_{user_id}.meta.json"
+
+    def _get_legacy_file(self, user_id: int) -> Path:
+        """Obtiene la ruta del archivo de conversación en el formato antiguo."""
         return self.conversations_dir / f"user_{user_id}.json"
 
-    def _load_user_data(self, user_id: int) -> Dict:
-        """Carga los datos de conversación de un usuario."""
-        user_file = self._get_user_file(user_id)
-
-        if user_file.exists():
-            with open(user_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
-
+    def _new_meta(self, user_id: int) -> Dict:
+        """Crea los datos iniciales de un usuario nuevo."""
         return {
             "user_id": user_id,
             "username": "",
             "first_name": "",
-            "created_at": datetime.now().isoformat(),
-            "messages": []
+            "created_at": _now_iso()
         }
 
-    def _save_user_data(self, user_id: int, data: Dict):
-        """Guarda los datos de conversación de un usuario."""
-        user_file = self._get_user_file(user_id)
+    def _read_meta(self, user_id: int) -> Optional[Dict]:
+        """Lee los datos de un usuario desde disco, o None si no existen."""
+        meta_file = self._get_meta_file(user_id)
+        if meta_file.exists():
+            return orjson.loads(_read_file(meta_file))
+
+        legacy_file = self._get_legacy_file(user_id)
+        if legacy_file.exists():
+            legacy = orjson.loads(_read_file(legacy_file))
+            legacy.pop("messages", None)
+            return legacy
+
+        return None
+
+    def _read_messages(self, user_id: int) -> List[Dict]:
+        """Lee todos los mensajes guardados en disco de un usuario."""
+        messages_file = self._get_messages_file(user_id)
+        if messages_file.exists():
+            return _decode_lines(messages_file, [line for line in _read_file(messages_file).splitlines() if line])
+
+        legacy_file = self._get_legacy_file(user_id)
+        if legacy_file.exists():
+            return orjson.loads(_read_file(legacy_file)).get("messages", [])
+
+        return []
+
+    def _read_last_messages(self, user_id: int, count: int) -> List[Dict]:
+        """Lee los últimos `count` mensajes guardados en disco de un usuario."""
+        if count <= 0:
+            return []
+
+        messages_file = self._get_messages_file(user_id)
+        if messages_file.exists():
+            # Una línea de más por si la última está dañada y se descarta
+            return _decode_lines(messages_file, _tail_lines(messages_file, count + 1))[-count:]
+
+        return self._read_messages(user_id)[-count:]
 
-        with open(user_file, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+    def _load_meta_for_write(self, user_id: int) -> Dict:
+        """
+        Obtiene los datos de un usuario para modificarlos, migrando antes
+        el archivo antiguo si existe.
+        """
+        meta = self._meta.get(user_id)
+        if meta is not None:
+            return meta
+
+        legacy_file = self._get_legacy_file(user_id)
+        if legacy_file.exists() and not self._get_meta_file(user_id).exists():
+            self._migrate_legacy(user_id)
+
+        # Antes de añadir nada, quitar una línea que una caída haya dejado a medias
+        messages_file = self._get_messages_file(user_id)
+        if messages_file.exists():
+            _truncate_torn_tail(messages_file)
+
+        meta = self._read_meta(user_id)
+        if meta is None:
+            meta = self._new_meta(user_id)
+            self._meta_dirty.add(user_id)
+
+        self._meta[user_id] = meta
+        self._recent[user_id] = deque(
+            self._read_last_messages(user_id, self.max_context_messages),
+            maxlen=self.max_context_messages
+        )
+        return meta
+
+    def _migrate_legacy(self, user_id: int):
+        """Convierte un archivo user_<id>.json al formato JSONL + metadatos."""
+        legacy_file = self._get_legacy_file(user_id)
+        data = orjson.loads(_read_file(legacy_file))
+        messages = data.pop("messages", [])
+
+        # Reescribir el JSONL entero (y no añadir) para que, si el proceso cae
+        # antes de borrar el archivo antiguo, repetir la migración no duplique
+        # el historial. La escritura atómica lo deja en disco antes del borrado.
+        payload = b"".join(orjson.dumps(msg, option=orjson.OPT_APPEND_NEWLINE) for msg in messages)
+        _write_file_atomic(self._get_messages_file(user_id), payload)
+        self._write_meta(user_id, data)
+        legacy_file.unlink()
+
+    def _append_messages(self, user_id: int, messages: List[Dict]):
+        """Añade mensajes al final del archivo JSONL de un usuario."""
+        if not messages:
+            return
+
+        payload = b"".join(orjson.dumps(msg, option=orjson.OPT_APPEND_NEWLINE) for msg in messages)
+        messages_file = self._get_messages_file(user_id)
+        fd = os.open(messages_file, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        try:
+            _write_all(fd, payload)
+        finally:
+            os.close(fd)
+
+        with self._sync_lock:
+            self._unsynced.add(messages_file)
+
+    def _write_meta(self, user_id: int, meta: Dict):
+        """Guarda los datos de un usuario."""
+        _write_file_atomic(
+            self._get_meta_file(user_id),
+            orjson.dumps(meta, option=orjson.OPT_NON_STR_KEYS)
+        )
+
+    def _load_index_for_write(self) -> Dict[str, Dict]:
+        """
+        Carga el índice de usuarios, reconstruyéndolo si no existe o no se
+        puede leer, y corrigiendo las entradas que hayan quedado atrasadas.
+        """
+        if self._index is None:
+            index = None
+            if self._index_file.exists():
+                try:
+                    index = orjson.loads(_read_file(self._index_file))
+                    self._reconcile_index(index)
+                except Exception as e:
+                    print(f"Error al leer {self._index_file}, se reconstruye: {e}")
+                    index = None
+            if index is None:
+                index = {str(summary["user_id"]): summary for summary in self._scan_users()}
+                self._index_dirty = True
+            self._index = index
+        return self._index
+
+    def _reconcile_index(self, index: Dict[str, Dict]):
+        """
+        Recalcula las entradas del índice de los usuarios cuyos archivos son
+        posteriores al propio índice.
+
+        El índice se escribe después de los mensajes; si el proceso termina
+        entre ambas escrituras, sus contadores quedan atrasados hasta aquí.
+
+        Args:
+            index: Índice leído de disco (se modifica en el sitio)
+        """
+        index_mtime = self._index_file.stat().st_mtime_ns
+        stale = set()
+        for user_file in self.conversations_dir.glob("user_*"):
+            user_id = user_file.name[len("user_"):].split(".", 1)[0]
+            if user_id.lstrip("-").isdigit() and user_file.stat().st_mtime_ns >= index_mtime:
+                stale.add(int(user_id))
+
+        for user_id in stale:
+            summary = self._load_user_summary(user_id)
+            if summary:
+                index[str(user_id)] = summary
+                self._index_dirty = True
+
+    def _write_index(self):
+        """Guarda el índice de usuarios si tiene cambios."""
+        if self._index_dirty:
+            self._index_dirty = False
+            # Sin fsync: si se pierde o queda atrasado se corrige al cargarlo
+            _write_file_atomic(self._index_file, orjson.dumps(self._index), sync=False)
+
+    def flush(self, user_id: int):
+        """Escribe a disco la conversación de un usuario si tiene cambios pendientes."""
+        # Cargar el índice antes de escribir para no contar dos veces los mensajes
+        index = self._load_index_for_write()
+
+        pending = self._pending.pop(user_id, None)
+        if pending:
+            self._append_messages(user_id, pending)
+
+        meta_dirty = user_id in self._meta_dirty
+        if meta_dirty:
+            self._meta_dirty.discard(user_id)
+            self._write_meta(user_id, self._meta[user_id])
+
+        if pending or meta_dirty:
+            meta = self._meta[user_id]
+            entry = index.setdefault(str(user_id), {"message_count": 0, "last_message": ""})
+            entry.update({
+                "user_id": user_id,
+                "username": meta.get("username", ""),
+                "first_name": meta.get("first_name", "Usuario"),
+                "created_at": meta.get("created_at", "")
+            })
+            if pending:
+                entry["message_count"] += len(pending)
+                entry["last_message"] = pending[-1]["timestamp"]
+            self._index_dirty = True
+
+    def flush_all(self):
+        """Escribe a disco todas las conversaciones con cambios pendientes y el índice."""
+        for user_id in list(self._pending.keys() | self._meta_dirty):
+            self.flush(user_id)
+        self._write_index()
+
+    def sync(self):
+        """
+        Fuerza a disco (fsync) los archivos de mensajes escritos desde la
+        última llamada. Puede ejecutarse en otro hilo mientras se siguen
+        añadiendo mensajes.
+        """
+        with self._sync_lock:
+            paths, self._unsynced = self._unsynced, set()
+
+        for path in paths:
+            try:
+                _fsync_path(path)
+            except FileNotFoundError:
+                # Historial borrado con /reset después de escribirlo
+                pass
 
     def add_message(self, user_id: int, role: str, content: str,
                    username: str = "", first_name: str = "", mood_info: Optional[Dict] = None):
@@ -64,28 +497,33 @@ class ConversationManager:
             first_name: Nombre del usuario (opcional)
             mood_info: Información del estado de ánimo del bot (opcional, solo para role='assistant')
         """
-        data = self._load_user_data(user_id)
+        meta = self._load_meta_for_write(user_id)
 
         # Actualizar información del usuario si está disponible
-        if username:
-            data["username"] = username
-        if first_name:
-            data["first_name"] = first_name
+        if username and meta.get("username") != username:
+            meta["username"] = username
+            self._meta_dirty.add(user_id)
+        if first_name and meta.get("first_name") != first_name:
+            meta["first_name"] = first_name
+            self._meta_dirty.add(user_id)
 
         # Añadir mensaje con timestamp
         message = {
             "role": role,
             "content": content,
-            "timestamp": datetime.now().isoformat()
+            "timestamp": _now_iso()
         }
 
         # Agregar información de mood si es un mensaje del asistente y hay mood disponible
         if role == "assistant" and mood_info:
             message["mood"] = mood_info
 
-        data["messages"].append(message)
-
-        self._save_user_data(user_id, data)
+        # Mantener en memoria y escribir a disco cada `flush_every` mensajes
+        self._recent[user_id].append(message)
+        pending = self._pending.setdefault(user_id, [])
+        pending.append(message)
+        if len(pending) >= self.flush_every:
+            self.flush(user_id)
 
     def get_context(self, user_id: int) -> List[Dict[str, str]]:
         """
@@ -97,42 +535,129 @@ class ConversationManager:
         Returns:
             Lista de mensajes en formato {"role": "user/assistant", "content": "..."}
         """
-        data = self._load_user_data(user_id)
-        messages = data["messages"]
-
         # Tomar solo los últimos N mensajes para el contexto
-        recent_messages = messages[-self.max_context_messages:]
-
-        # Formatear para el LLM (sin timestamp)
-        return [
-            {"role": msg["role"], "content": msg["content"]}
-            for msg in recent_messages
-        ]
+        recent_messages = self._recent.get(user_id)
+        if recent_messages is None:
+            recent_messages = self._read_last_messages(user_id, self.max_context_messages)
+
+        # Formatear para el LLM (sin timestamp), empezando por el final para
+        # descartar los mensajes más antiguos si se supera el límite de caracteres
+        context = []
+        total_chars = 0
+        for msg in reversed(recent_messages):
+            total_chars += len(msg["content"])
+            if context and self.max_context_chars and total_chars > self.max_context_chars:
+                break
+            context.append({"role": msg["role"], "content": msg["content"]})
+        context.reverse()
+        return context
 
     def get_full_history(self, user_id: int) -> Dict:
         """Obtiene todo el historial de conversación de un usuario."""
-        return self._load_user_data(user_id)
+        meta = self._meta.get(user_id) or self._read_meta(user_id) or self._new_meta(user_id)
 
-    def get_all_users(self) -> List[Dict]:
-        """Obtiene información básica de todos los usuarios."""
-        users = []
+        data = dict(meta)
+        data["messages"] = self._read_messages(user_id) + self._pending.get(user_id, [])
+        return data
+
+    def export_user(self, user_id: int) -> bytes:
+        """
+        Exporta el historial completo de un usuario como JSON legible.
 
+        Los archivos en disco se guardan compactos; el formato con sangría
+        solo se genera aquí, para descargas desde la interfaz web.
+
+        Args:
+            user_id: ID del usuario
+
+        Returns:
+            Contenido JSON con sangría, en bytes UTF-8
+        """
+        return orjson.dumps(self.get_full_history(user_id),
+                            option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+
+    def _load_user_summary(self, user_id: int) -> Optional[Dict]:
+        """
+        Obtiene el resumen de un usuario para el listado sin parsear sus mensajes.
+
+        Args:
+            user_id: ID del usuario
+
+        Returns:
+            Diccionario con datos del usuario, número de mensajes y fecha del
+            último, o None si no se pudo leer
+        """
+        try:
+            meta = self._meta.get(user_id) or self._read_meta(user_id) or self._new_meta(user_id)
+
+            messages_file = self._get_messages_file(user_id)
+            if messages_file.exists():
+                # Contar líneas completas y parsear solo las últimas (la final
+                # puede estar a medias si el proceso cayó mientras escribía)
+                message_count = _read_file(messages_file).count(b"\n")
+                last_messages = _decode_lines(messages_file, _tail_lines(messages_file, 2))
+                last_message = last_messages[-1]["timestamp"] if last_messages else ""
+            else:
+                messages = self._read_messages(user_id)
+                message_count = len(messages)
+                last_message = messages[-1]["timestamp"] if messages else ""
+
+            return {
+                "user_id": meta["user_id"],
+                "username": meta.get("username", ""),
+                "first_name": meta.get("first_name", "Usuario"),
+                "created_at": meta.get("created_at", ""),
+                "message_count": message_count,
+                "last_message": last_message
+            }
+        except Exception as e:
+            print(f"Error al leer conversación del usuario {user_id}: {e}")
+            return None
+
+    def _scan_users(self) -> List[Dict]:
+        """Calcula el resumen de todos los usuarios leyendo sus archivos."""
+        user_ids = set()
         for user_file in self.conversations_dir.glob("user_*.json"):
+            user_id = user_file.name[len("user_"):].split(".", 1)[0]
+            if user_id.lstrip("-").isdigit():
+                user_ids.add(int(user_id))
+
+        # Leer los archivos en paralelo: la E/S y orjson liberan el GIL
+        with ThreadPoolExecutor(max_workers=USERS_SCAN_WORKERS) as executor:
+            return [summary for summary in executor.map(self._load_user_summary, user_ids) if summary]
+
+    def get_all_users(self) -> List[Dict]:
+        """Obtiene información básica de todos los usuarios."""
+        # Usar el índice si existe; si no, leer los archivos de cada usuario
+        index = self._index
+        if index is None and self._index_file.exists():
             try:
-                with open(user_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-
-                messages = data.get("messages", [])
-                users.append({
-                    "user_id": data["user_id"],
-                    "username": data.get("username", ""),
-                    "first_name": data.get("first_name", "Usuario"),
-                    "created_at": data.get("created_at", ""),
-                    "message_count": len(messages),
-                    "last_message": messages[-1]["timestamp"] if messages else ""
-                })
+                index = orjson.loads(_read_file(self._index_file))
             except Exception as e:
-                print(f"Error al leer {user_file}: {e}")
+                print(f"Error al leer {self._index_file}: {e}")
+
+        if index is not None:
+            users = [dict(entry) for entry in index.values()]
+        else:
+            users = self._scan_users()
+
+        # Añadir los mensajes que este proceso aún no ha escrito a disco
+        users_by_id = {user["user_id"]: user for user in users}
+        for user_id, pending in self._pending.items():
+            user = users_by_id.get(user_id)
+            if user is None:
+                meta = self._meta[user_id]
+                user = {
+                    "user_id": user_id,
+                    "username": meta.get("username", ""),
+                    "first_name": meta.get("first_name", "Usuario"),
+                    "created_at": meta.get("created_at", ""),
+                    "message_count": 0,
+                    "last_message": ""
+                }
+                users.append(user)
+            user["message_count"] += len(pending)
+            user["last_message"] = pending[-1]["timestamp"]
 
         # Ordenar por último mensaje (más reciente primero)
         users.sort(key=lambda x: x.get("last_message", ""), reverse=True)
@@ -151,19 +676,29 @@ class ConversationManager:
         Returns:
             Lista de mensajes en el rango de fechas
         """
-        data = self._load_user_data(user_id)
-        messages = data["messages"]
+        messages = self.get_full_history(user_id)["messages"]
 
-        filtered_messages = []
-        for msg in messages:
-            msg_date = msg["timestamp"].split("T")[0]
-            if start_date <= msg_date <= end_date:
-                filtered_messages.append(msg)
+        # Los mensajes se añaden en orden y las fechas ISO se ordenan igual
+        # como texto, así que basta una búsqueda binaria por cada extremo
+        timestamps = [msg["timestamp"] for msg in messages]
+        lo = bisect.bisect_left(timestamps, start_date)
+        hi = bisect.bisect_right(timestamps, end_date + "T99")
 
-        return filtered_messages
+        return messages[lo:hi]
 
     def clear_user_history(self, user_id: int):
         """Elimina el historial de conversación de un usuario."""
-        user_file = self._get_user_file(user_id)
-        if user_file.exists():
-            user_file.unlink()
+        self._meta.pop(user_id, None)
+        self._pending.pop(user_id, None)
+        self._meta_dirty.discard(user_id)
+        self._recent.pop(user_id, None)
+
+        for user_file in (self._get_messages_file(user_id),
+                          self._get_meta_file(user_id),
+                          self._get_legacy_file(user_id)):
+            if user_file.exists():
+                user_file.unlink()
+
+        if self._load_index_for_write().pop(str(user_id), None) is not None:
+            self._index_dirty = True
+        self._write_index()
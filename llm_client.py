@@ -1,21 +1,97 @@
 """
 Cliente para interactuar con la API de Google Gemini.
 """
+import asyncio
+import hashlib
+import logging
+import random
+import threading
+import time
+from collections import OrderedDict
+
+import orjson
+import requests
 from google import genai
-from google.genai import types
+from google.genai import errors, types
 from typing import List, Dict, Optional
 from logger_config import get_logger
 
 # Logger específico para LLM
 logger = get_logger('llm')
 
+# Temperatura máxima con la que se cachean respuestas: por encima, la
+# misma petición puede dar respuestas distintas y no tiene sentido repetirlas
+CACHE_MAX_TEMPERATURE = 0.1
+
+# Reintentos ante errores transitorios de la API (429, 5xx, fallos de conexión):
+# espera aleatoria entre 0 y RETRY_BASE_DELAY * 2^intento, sin pasar de RETRY_MAX_DELAY
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 8.0
+
+# Roles del historial en el formato de Gemini, que usa 'model' en lugar de 'assistant'
+_GEMINI_ROLES = {"user": "user", "assistant": "model", "model": "model"}
+
+# Clientes de la API compartidos por API key (LLM, TTS y recargas de configuración)
+_genai_clients: Dict[str, genai.Client] = {}
+_genai_clients_lock = threading.Lock()
+
+
+def get_genai_client(api_key: str) -> genai.Client:
+    """
+    Obtiene el cliente de Gemini para una API key, creándolo la primera vez.
+
+    Args:
+        api_key: Clave de API de Google Gemini
+
+    Returns:
+        Cliente compartido para esa API key
+    """
+    with _genai_clients_lock:
+        client = _genai_clients.get(api_key)
+        if client is None:
+            client = genai.Client(api_key=api_key)
+            _genai_clients[api_key] = client
+        return client
+
+
+def _is_transient(error: Exception) -> bool:
+    """Indica si un error de la API es transitorio (429, 5xx o fallo de conexión)."""
+    if isinstance(error, errors.APIError):
+        return error.code == 429 or bool(error.code and error.code >= 500)
+    return isinstance(error, (requests.ConnectionError, requests.Timeout))
+
+
+def _retry_delay(error: Exception, attempt: int) -> Optional[float]:
+    """
+    Calcula cuánto esperar antes de reintentar una petición fallida.
+
+    Args:
+        error: Excepción producida por la petición
+        attempt: Número de intento que ha fallado (empezando en 0)
+
+    Returns:
+        Segundos de espera, o None si el error no es transitorio
+    """
+    if not _is_transient(error):
+        return None
+
+    # Respetar la cabecera Retry-After si la API la envía
+    if isinstance(error, errors.APIError):
+        headers = getattr(error.response, "headers", None) or {}
+        retry_after = headers.get("Retry-After")
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), RETRY_MAX_DELAY)
+
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+
 
 class LLMClient:
     """Cliente para hacer llamadas a la API de LLM."""
 
     def __init__(self, api_key: str, model: str, max_tokens: int = 1024,
                  temperature: float = 0.7, system_prompt: str = "",
-                 api_url: str = ""):
+                 api_url: str = "", cache_size: int = 128, max_concurrency: int = 4,
+                 max_retries: int = 3):
         """
         Inicializa el cliente del LLM.
 
@@ -26,12 +102,15 @@ class LLMClient:
             temperature: Temperatura para la generación
             system_prompt: Prompt del sistema que define el comportamiento del asistente
             api_url: No usado para Gemini (mantenido por compatibilidad)
+            cache_size: Respuestas guardadas en la caché de peticiones idénticas (0 la desactiva)
+            max_concurrency: Peticiones simultáneas máximas a la API desde aget_response
+            max_retries: Reintentos ante errores transitorios de la API
         """
         logger.info(f"Inicializando LLMClient con modelo: {model}")
         logger.debug(f"Configuración - max_tokens: {max_tokens}, temperature: {temperature}")
 
-        # Crear cliente con API key
-        self.client = genai.Client(api_key=api_key)
+        # Obtener el cliente compartido para esta API key
+        self.client = get_genai_client(api_key)
 
         # Guardar configuración
         self.temperature = temperature
@@ -40,8 +119,106 @@ class LLMClient:
         self.base_model_name = model
         self.api_key = api_key
 
+        # System instruction completo (prompt base + contexto adicional),
+        # recalculado solo cuando cambia alguna de las dos partes
+        self.current_additional_context = ""
+        self._system_instruction = system_prompt
+
+        # Caché LRU de respuestas para peticiones idénticas con temperatura baja
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, str]" = OrderedDict()
+        self.cache_stats = {"hits": 0, "misses": 0}
+
+        self.max_retries = max(0, max_retries)
+
+        # Límite de peticiones asíncronas en curso
+        self._semaphore = asyncio.Semaphore(max(1, max_concurrency))
+        # Peticiones cacheables en curso, para que las idénticas esperen a la primera
+        self._inflight: Dict[str, "asyncio.Future[str]"] = {}
+
         logger.info("LLMClient inicializado correctamente")
 
+    def update_params(self, model: Optional[str] = None, max_tokens: Optional[int] = None,
+                      temperature: Optional[float] = None, system_prompt: Optional[str] = None,
+                      cache_size: Optional[int] = None, max_retries: Optional[int] = None):
+        """
+        Actualiza los parámetros de generación sin recrear el cliente de la API.
+
+        Args:
+            model: Nuevo nombre del modelo (opcional)
+            max_tokens: Nuevo número máximo de tokens (opcional)
+            temperature: Nueva temperatura (opcional)
+            system_prompt: Nuevo prompt del sistema (opcional)
+            cache_size: Nuevo tamaño de la caché de respuestas (opcional)
+            max_retries: Nuevo número de reintentos ante errores transitorios (opcional)
+        """
+        if model is not None:
+            self.base_model_name = model
+        if max_tokens is not None:
+            self.max_tokens = max_tokens
+        if temperature is not None:
+            self.temperature = temperature
+        if system_prompt is not None:
+            self.system_prompt = system_prompt
+            self._refresh_system_instruction()
+        if cache_size is not None:
+            self.cache_size = cache_size
+            while len(self._cache) > max(0, cache_size):
+                self._cache.popitem(last=False)
+        if max_retries is not None:
+            self.max_retries = max(0, max_retries)
+
+        logger.info(f"🔄 Parámetros actualizados - modelo: {self.base_model_name}, "
+                    f"max_tokens: {self.max_tokens}, temperature: {self.temperature}")
+
+    def _cache_key(self, system_instruction: str, messages: List[Dict[str, str]]) -> Optional[str]:
+        """
+        Calcula la clave de caché de una petición.
+
+        Args:
+            system_instruction: System instruction completo de la petición
+            messages: Mensajes enviados al modelo
+
+        Returns:
+            Hash de la petición, o None si no se debe cachear
+        """
+        if self.cache_size <= 0 or self.temperature > CACHE_MAX_TEMPERATURE:
+            return None
+
+        payload = orjson.dumps([
+            self.base_model_name, self.temperature, self.max_tokens,
+            system_instruction, messages
+        ])
+        return hashlib.sha256(payload).hexdigest()
+
+    def _cache_store(self, key: str, response_text: str):
+        """Guarda una respuesta en la caché, descartando la más antigua si está llena."""
+        self._cache[key] = response_text
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _refresh_system_instruction(self):
+        """Recalcula el system instruction completo a partir de sus dos partes."""
+        if self.current_additional_context:
+            self._system_instruction = self.system_prompt + "\n" + self.current_additional_context
+        else:
+            self._system_instruction = self.system_prompt
+
+    def _log_api_error(self, error: Exception):
+        """
+        Registra el error de una petición fallida.
+
+        Los errores transitorios (límite de peticiones, caídas del servicio)
+        son esperables y se registran sin traza para no llenar el log
+        durante una caída; el resto se registra con la traza completa.
+        """
+        if _is_transient(error):
+            logger.error("Error transitorio de la API de Gemini tras %d reintentos: %s",
+                         self.max_retries, error)
+        else:
+            logger.error("Error al comunicarse con la API de Gemini: %s", error, exc_info=True)
+
     def update_system_prompt(self, additional_context: str = ""):
         """
         Actualiza el system prompt del modelo con contexto adicional.
@@ -49,14 +226,99 @@ class LLMClient:
         Args:
             additional_context: Texto adicional para agregar al system prompt
         """
-        logger.debug("Actualizando system prompt con contexto adicional")
+        # El contexto de mood casi siempre es el mismo que en la petición anterior
+        if additional_context == self.current_additional_context:
+            return
 
-        # Solo guardamos el contexto adicional para usarlo en get_response
-        if additional_context:
-            self.current_additional_context = additional_context
-            logger.debug(f"Contexto adicional agregado (longitud: {len(additional_context)} caracteres)")
-        else:
-            self.current_additional_context = ""
+        logger.debug("Actualizando system prompt con contexto adicional (longitud: %d caracteres)",
+                     len(additional_context))
+        self.current_additional_context = additional_context
+        self._refresh_system_instruction()
+
+    def _build_request(self, messages: List[Dict[str, str]], mood_context: str = ""):
+        """
+        Prepara la petición al modelo a partir del historial de mensajes.
+
+        Args:
+            messages: Lista de mensajes en formato [{"role": "user/assistant", "content": "..."}]
+            mood_context: Contexto adicional sobre el estado de ánimo (opcional)
+
+        Returns:
+            Tupla (clave de caché o None, contenidos, configuración de generación)
+        """
+        # Actualizar el system prompt si hay contexto de mood
+        if mood_context:
+            logger.debug("Incluyendo contexto de mood en la solicitud")
+            self.update_system_prompt(mood_context)
+
+        # Preparar system instruction completo. El prompt base va siempre
+        # delante y el contexto de mood detrás, para que el inicio de la
+        # petición sea idéntico entre mensajes y Gemini pueda cachearlo
+        system_instruction = self._system_instruction
+
+        # Log del system prompt utilizado (solo se formatea con DEBUG activo)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("System prompt base (longitud: %d caracteres): '%s...'",
+                         len(self.system_prompt), self.system_prompt[:150])
+            if self.current_additional_context:
+                logger.debug("Contexto adicional (longitud: %d caracteres): '%s...'",
+                             len(self.current_additional_context), self.current_additional_context[:150])
+            logger.debug("System instruction completo (longitud: %d caracteres)",
+                         len(system_instruction) if system_instruction else 0)
+
+        cache_key = self._cache_key(system_instruction, messages)
+
+        # Convertir formato de mensajes a formato Gemini
+        contents = [
+            types.Content(
+                role=_GEMINI_ROLES.get(msg["role"], "model"),
+                parts=[types.Part(text=msg["content"])]
+            )
+            for msg in messages
+        ]
+
+        logger.debug("Historial convertido: %d mensajes", len(contents))
+
+        # Configurar la generación
+        config = types.GenerateContentConfig(
+            temperature=self.temperature,
+            max_output_tokens=self.max_tokens,
+            system_instruction=system_instruction if system_instruction else None
+        )
+
+        return cache_key, contents, config
+
+    def _cache_lookup(self, cache_key: Optional[str]) -> Optional[str]:
+        """Devuelve la respuesta cacheada para una petición idéntica a una anterior, o None."""
+        if cache_key is None:
+            return None
+
+        cached = self._cache.get(cache_key)
+        if cached is None:
+            self.cache_stats["misses"] += 1
+            return None
+
+        self._cache.move_to_end(cache_key)
+        self.cache_stats["hits"] += 1
+        logger.info("Respuesta obtenida de la caché (aciertos: %d, fallos: %d)",
+                    self.cache_stats["hits"], self.cache_stats["misses"])
+        return cached
+
+    def _handle_response(self, cache_key: Optional[str], response) -> str:
+        """Extrae el texto de la respuesta del modelo y lo guarda en la caché."""
+        response_text = response.text
+        logger.info("Respuesta recibida del LLM (longitud: %d caracteres)", len(response_text))
+
+        # Tokens del prompt servidos desde la caché implícita de Gemini, que
+        # solo funciona si el inicio de la petición no cambia entre mensajes
+        usage = response.usage_metadata
+        if usage is not None:
+            logger.debug("Tokens del prompt: %s, en caché: %s",
+                         usage.prompt_token_count, usage.cached_content_token_count or 0)
+
+        if cache_key is not None and response_text:
+            self._cache_store(cache_key, response_text)
+        return response_text
 
     def get_response(self, messages: List[Dict[str, str]], mood_context: str = "") -> str:
         """
@@ -70,56 +332,113 @@ class LLMClient:
             Respuesta generada por el LLM
         """
         try:
-            logger.info(f"Solicitando respuesta del LLM (mensajes en contexto: {len(messages)})")
-
-            # Actualizar el system prompt si hay contexto de mood
-            if mood_context:
-                logger.debug("Incluyendo contexto de mood en la solicitud")
-                self.update_system_prompt(mood_context)
-
-            # Preparar system instruction completo
-            system_instruction = self.system_prompt
-            if hasattr(self, 'current_additional_context') and self.current_additional_context:
-                system_instruction += "\n" + self.current_additional_context
-
-            # Log del system prompt utilizado
-            logger.debug(f"System prompt base (longitud: {len(self.system_prompt)} caracteres): '{self.system_prompt[:150]}...'")
-            if hasattr(self, 'current_additional_context') and self.current_additional_context:
-                logger.debug(f"Contexto adicional (longitud: {len(self.current_additional_context)} caracteres): '{self.current_additional_context[:150]}...'")
-            logger.debug(f"System instruction completo (longitud: {len(system_instruction) if system_instruction else 0} caracteres)")
-
-            # Convertir formato de mensajes a formato Gemini
-            # Gemini usa 'user' y 'model' en lugar de 'user' y 'assistant'
-            contents = []
-            for msg in messages:
-                role = "user" if msg["role"] == "user" else "model"
-                contents.append(types.Content(
-                    role=role,
-                    parts=[types.Part(text=msg["content"])]
-                ))
-
-            logger.debug(f"Historial convertido: {len(contents)} mensajes")
-
-            # Configurar la generación
-            config = types.GenerateContentConfig(
-                temperature=self.temperature,
-                max_output_tokens=self.max_tokens,
-                system_instruction=system_instruction if system_instruction else None
-            )
+            logger.info("Solicitando respuesta del LLM (mensajes en contexto: %d)", len(messages))
 
-            # Generar respuesta
-            response = self.client.models.generate_content(
-                model=self.base_model_name,
-                contents=contents,
-                config=config
-            )
+            cache_key, contents, config = self._build_request(messages, mood_context)
+            cached = self._cache_lookup(cache_key)
+            if cached is not None:
+                return cached
+
+            # Generar respuesta, reintentando si el error es transitorio
+            attempt = 0
+            while True:
+                try:
+                    response = self.client.models.generate_content(
+                        model=self.base_model_name,
+                        contents=contents,
+                        config=config
+                    )
+                    break
+                except Exception as e:
+                    delay = _retry_delay(e, attempt) if attempt < self.max_retries else None
+                    if delay is None:
+                        raise
+                    attempt += 1
+                    logger.warning("Error transitorio de la API (%s), reintento %d/%d en %.1f segundos",
+                                   e, attempt, self.max_retries, delay)
+                    time.sleep(delay)
+            return self._handle_response(cache_key, response)
+
+        except Exception as e:
+            self._log_api_error(e)
+            return "Disculpa, hubo un problema al comunicarme con el servicio. ¿Podrías intentarlo de nuevo?"
+
+    async def _agenerate(self, contents, config):
+        """
+        Llama a la API de forma asíncrona, reintentando si el error es transitorio.
+
+        Args:
+            contents: Contenidos de la petición
+            config: Configuración de generación
+
+        Returns:
+            Respuesta de la API
+        """
+        attempt = 0
+        while True:
+            try:
+                async with self._semaphore:
+                    return await self.client.aio.models.generate_content(
+                        model=self.base_model_name,
+                        contents=contents,
+                        config=config
+                    )
+            except Exception as e:
+                delay = _retry_delay(e, attempt) if attempt < self.max_retries else None
+                if delay is None:
+                    raise
+                attempt += 1
+                logger.warning("Error transitorio de la API (%s), reintento %d/%d en %.1f segundos",
+                               e, attempt, self.max_retries, delay)
+                await asyncio.sleep(delay)
+
+    async def aget_response(self, messages: List[Dict[str, str]], mood_context: str = "") -> str:
+        """
+        Versión asíncrona de get_response, para no bloquear el bucle de eventos del bot.
+
+        El número de peticiones simultáneas a la API se limita con `max_concurrency`.
+        Si llega una petición cacheable idéntica a otra que aún está en curso,
+        espera a esa en lugar de hacer una llamada nueva.
+
+        Args:
+            messages: Lista de mensajes en formato [{"role": "user/assistant", "content": "..."}]
+            mood_context: Contexto adicional sobre el estado de ánimo (opcional)
+
+        Returns:
+            Respuesta generada por el LLM
+        """
+        try:
+            logger.info("Solicitando respuesta del LLM (mensajes en contexto: %d)", len(messages))
+
+            cache_key, contents, config = self._build_request(messages, mood_context)
+            cached = self._cache_lookup(cache_key)
+            if cached is not None:
+                return cached
+
+            if cache_key is None:
+                return self._handle_response(None, await self._agenerate(contents, config))
+
+            inflight = self._inflight.get(cache_key)
+            if inflight is not None:
+                logger.info("Petición idéntica en curso, esperando su respuesta")
+                return await asyncio.shield(inflight)
 
-            response_text = response.text
-            logger.info(f"Respuesta recibida del LLM (longitud: {len(response_text)} caracteres)")
-            return response_text
+            future = asyncio.get_running_loop().create_future()
+            self._inflight[cache_key] = future
+            try:
+                response_text = self._handle_response(cache_key, await self._agenerate(contents, config))
+                future.set_result(response_text)
+                return response_text
+            finally:
+                del self._inflight[cache_key]
+                if not future.done():
+                    # La petición falló o se canceló: avisar a las que esperaban.
+                    # Se marca la excepción como recogida por si no había ninguna.
+                    future.set_exception(RuntimeError("La petición idéntica en curso no terminó"))
+                    future.exception()
 
         except Exception as e:
-            logger.error(f"Error al comunicarse con la API de Gemini: {e}", exc_info=True)
+            self._log_api_error(e)
             return "Disculpa, hubo un problema al comunicarme con el servicio. ¿Podrías intentarlo de nuevo?"
 
     def chat(self, user_message: str, context: List[Dict[str, str]] = None) -> str:
@@ -133,8 +452,7 @@ class LLMClient:
         Returns:
             Respuesta del asistente
         """
-        logger.debug(f"Método chat llamado con mensaje: '{user_message[:50]}...'")
-        messages = context.copy() if context else []
-        messages.append({"role": "user", "content": user_message})
+        logger.debug("Método chat llamado con mensaje: '%s...'", user_message[:50])
+        messages = [*(context or ()), {"role": "user", "content": user_message}]
 
         return self.get_response(messages)
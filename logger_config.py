@@ -1,12 +1,29 @@
 """
 Configuración centralizada de logging para el bot.
 Crea loggers separados para Telegram y LLM con rotación diaria.
+
+Los loggers solo encolan los registros; un hilo por logger los escribe en
+archivo y consola, para que el bucle de eventos del bot no espere al disco.
 """
+import atexit
 import logging
 import os
-from logging.handlers import TimedRotatingFileHandler
+import queue
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
 from datetime import datetime
-from typing import Dict, Any
+from typing import Dict, Any, List
+
+# Hilos que escriben los registros encolados, uno por logger configurado
+_listeners: List[QueueListener] = []
+
+
+def _stop_listeners():
+    """Detiene los hilos de escritura, vaciando antes sus colas."""
+    while _listeners:
+        _listeners.pop().stop()
+
+
+atexit.register(_stop_listeners)
 
 
 def setup_logging(config: Dict[str, Any]) -> Dict[str, logging.Logger]:
@@ -28,6 +45,9 @@ def setup_logging(config: Dict[str, Any]) -> Dict[str, logging.Logger]:
     # Crear directorio de logs si no existe
     os.makedirs(log_dir, exist_ok=True)
 
+    # Si se vuelve a configurar, parar los hilos de la configuración anterior
+    _stop_listeners()
+
     # Configurar formato
     formatter = logging.Formatter(log_format, datefmt=date_format)
 
@@ -55,7 +75,8 @@ def setup_logging(config: Dict[str, Any]) -> Dict[str, logging.Logger]:
             when='midnight',  # Rotar a medianoche
             interval=1,  # Cada 1 día
             backupCount=30,  # Mantener 30 días de logs
-            encoding='utf-8'
+            encoding='utf-8',
+            delay=True  # Abrir el archivo con el primer registro
         )
 
         # Configurar nombre de archivo de respaldo con fecha
@@ -63,14 +84,17 @@ def setup_logging(config: Dict[str, Any]) -> Dict[str, logging.Logger]:
         file_handler.setFormatter(formatter)
         file_handler.setLevel(getattr(logging, level.upper()))
 
-        # Agregar handler al logger
-        logger.addHandler(file_handler)
-
         # Agregar también handler para consola
         console_handler = logging.StreamHandler()
         console_handler.setFormatter(formatter)
         console_handler.setLevel(getattr(logging, level.upper()))
-        logger.addHandler(console_handler)
+
+        # El logger encola los registros y un hilo los pasa a ambos handlers
+        log_queue = queue.SimpleQueue()
+        logger.addHandler(QueueHandler(log_queue))
+        listener = QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+        listener.start()
+        _listeners.append(listener)
 
         # Evitar propagación al logger raíz
         logger.propagate = False
@@ -5,11 +5,23 @@ Determina el mood del bot para ajustar su personalidad en las conversaciones.
 import ephem
 import requests
 import logging
-from datetime import datetime
+from datetime import datetime, timedelta
 from typing import Dict, Optional
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 logger = logging.getLogger(__name__)
 
+# Sesión HTTP compartida por todas las instancias (se recrean al recargar la
+# configuración), con reintentos ante fallos de conexión y errores 5xx
+_http_adapter = HTTPAdapter(
+    pool_connections=1, pool_maxsize=4,
+    max_retries=Retry(total=2, backoff_factor=0.2, status_forcelist=(502, 503, 504))
+)
+_http_session = requests.Session()
+_http_session.mount("http://", _http_adapter)
+_http_session.mount("https://", _http_adapter)
+
 
 class MoodManager:
     """Gestiona el estado de ánimo del bot basado en factores externos."""
@@ -75,6 +87,8 @@ class MoodManager:
         self.location = location
         self.current_mood = None
         self.last_update = None
+        # Prompt del mood actual, generado al calcular el mood
+        self._mood_prompt = None
 
     def _get_moon_phase(self) -> str:
         """
@@ -92,7 +106,7 @@ class MoodManager:
 
             # Calcular la fase basada en la iluminación
             # También necesitamos saber si está creciendo o menguando
-            tomorrow = ephem.Moon(datetime(now.year, now.month, now.day + 1 if now.day < 28 else 1))
+            tomorrow = ephem.Moon(now + timedelta(days=1))
             tomorrow_illumination = tomorrow.phase / 100.0
 
             is_waxing = tomorrow_illumination > illumination
@@ -137,7 +151,7 @@ class MoodManager:
                 "lang": "es"
             }
 
-            response = requests.get(url, params=params, timeout=5)
+            response = _http_session.get(url, params=params, timeout=5)
 
             if response.status_code == 200:
                 data = response.json()
@@ -203,6 +217,13 @@ class MoodManager:
             )
 
         self.current_mood = mood
+        self._mood_prompt = (
+            f"\nESTADO DE ÁNIMO ACTUAL: Hoy te sientes {mood['base_mood']}, "
+            f"es decir, {mood['final_description']}. "
+            "Deja que este estado de ánimo influya sutilmente en tus respuestas, "
+            "pero sin mencionarlo explícitamente al usuario. "
+            "Tu personalidad debe reflejar este mood de manera natural."
+        )
         self.last_update = datetime.now()
 
         logger.info(f"Mood calculado: {mood['base_mood']} (luna: {moon_phase})")
@@ -213,7 +234,8 @@ class MoodManager:
 
     def get_mood_prompt(self) -> str:
         """
-        Genera el texto de prompt para inyectar en el system prompt del LLM.
+        Devuelve el texto de prompt para inyectar en el system prompt del LLM.
+        Se genera una sola vez en cada cálculo del mood.
 
         Returns:
             Texto describiendo el mood actual para el LLM
@@ -221,15 +243,7 @@ class MoodManager:
         if not self.current_mood:
             self.calculate_mood()
 
-        mood = self.current_mood
-
-        prompt = f"\nESTADO DE ÁNIMO ACTUAL: Hoy te sientes {mood['base_mood']}, "
-        prompt += f"es decir, {mood['final_description']}. "
-        prompt += "Deja que este estado de ánimo influya sutilmente en tus respuestas, "
-        prompt += "pero sin mencionarlo explícitamente al usuario. "
-        prompt += "Tu personalidad debe reflejar este mood de manera natural."
-
-        return prompt
+        return self._mood_prompt
 
     def should_update(self) -> bool:
         """
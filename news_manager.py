@@ -2,16 +2,45 @@
 Gestor de noticias RSS para el bot.
 Consulta feeds RSS, almacena noticias y proporciona noticias aleatorias.
 """
-import json
+import os
 import random
+import re
+import threading
+import time
 import logging
-from datetime import datetime, timedelta
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from pathlib import Path
 from typing import List, Dict, Optional
 import feedparser
+import orjson
+import requests
+from requests.adapters import HTTPAdapter
 
 logger = logging.getLogger(__name__)
 
+# Intervalo entre actualizaciones del caché de noticias (segundos)
+UPDATE_INTERVAL = 24 * 60 * 60
+
+# Número máximo de noticias que se toman de cada feed
+MAX_ENTRIES_PER_FEED = 10
+
+# Número máximo de feeds que se descargan a la vez
+MAX_FEED_WORKERS = 8
+
+# Tiempo máximo de espera al descargar un feed (segundos)
+FEED_TIMEOUT = 10
+
+_HTML_TAG_RE = re.compile(r'<[^>]+>')
+
+# Sesión HTTP compartida para reutilizar conexiones entre feeds y recargas
+_http_adapter = HTTPAdapter(pool_maxsize=MAX_FEED_WORKERS)
+_http_session = requests.Session()
+_http_session.mount("http://", _http_adapter)
+_http_session.mount("https://", _http_adapter)
+_http_session.headers["User-Agent"] = feedparser.USER_AGENT
+
 
 class NewsManager:
     """Gestiona la consulta y almacenamiento de noticias RSS."""
@@ -27,13 +56,16 @@ class NewsManager:
         self.rss_feeds = rss_feeds
         self.storage_file = Path(storage_file)
         self.news_cache = self._load_cache()
+        self._next_update = self._initial_deadline()
+        self._shuffled_news = deque()
+        self._update_lock = threading.Lock()
+        self._reshuffle()
 
     def _load_cache(self) -> Dict:
         """Carga el caché de noticias desde el archivo."""
         if self.storage_file.exists():
             try:
-                with open(self.storage_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+                return orjson.loads(self.storage_file.read_bytes())
             except Exception as e:
                 logger.error(f"Error al cargar caché de noticias: {e}")
                 return {"last_update": None, "news": []}
@@ -42,67 +74,122 @@ class NewsManager:
     def _save_cache(self):
         """Guarda el caché de noticias en el archivo."""
         try:
-            with open(self.storage_file, 'w', encoding='utf-8') as f:
-                json.dump(self.news_cache, f, ensure_ascii=False, indent=2)
+            # Escribir en un temporal y renombrar: si el proceso muere a mitad
+            # de escritura, el caché anterior sigue intacto
+            tmp_file = self.storage_file.with_name(self.storage_file.name + '.tmp')
+            tmp_file.write_bytes(orjson.dumps(self.news_cache))
+            os.replace(tmp_file, self.storage_file)
         except Exception as e:
             logger.error(f"Error al guardar caché de noticias: {e}")
 
-    def _should_update(self) -> bool:
+    def _reshuffle(self):
         """
-        Verifica si se debe actualizar el caché de noticias.
-        Se actualiza una vez al día.
+        Prepara una ronda barajada de las noticias en caché para que
+        get_random_news no repita ninguna hasta haberlas dado todas.
+        """
+        news_list = self.news_cache.get("news", [])
+        self._shuffled_news = deque(random.sample(news_list, len(news_list)))
+
+    def _initial_deadline(self) -> float:
+        """
+        Calcula, a partir de la fecha guardada en el caché, el instante
+        (en tiempo monótono) en que toca la próxima actualización.
 
         Returns:
-            True si debe actualizarse, False en caso contrario
+            Instante de la próxima actualización según time.monotonic()
         """
         last_update = self.news_cache.get("last_update")
 
         if not last_update:
-            return True
+            return 0.0
 
         try:
             last_update_date = datetime.fromisoformat(last_update)
-            now = datetime.now()
-
-            # Actualizar si pasó más de un día
-            return (now - last_update_date) >= timedelta(days=1)
+            remaining = UPDATE_INTERVAL - (datetime.now() - last_update_date).total_seconds()
+            return time.monotonic() + max(0.0, remaining)
         except Exception as e:
             logger.error(f"Error al verificar fecha de actualización: {e}")
-            return True
+            return 0.0
+
+    def _should_update(self) -> bool:
+        """
+        Verifica si se debe actualizar el caché de noticias.
+        Se actualiza una vez al día.
 
-    def _parse_feed(self, feed_url: str) -> List[Dict]:
+        Returns:
+            True si debe actualizarse, False en caso contrario
+        """
+        # La fecha solo se interpreta al crear el gestor; aquí basta comparar
+        return time.monotonic() >= self._next_update
+
+    def _parse_feed(self, feed_url: str, cached_items: Optional[List[Dict]] = None) -> List[Dict]:
         """
         Parsea un feed RSS y extrae las noticias.
 
+        Si hay noticias previas del feed se hace una petición condicional
+        (ETag / Last-Modified); cuando el servidor responde 304 se reutilizan
+        sin descargar ni parsear el feed de nuevo.
+
         Args:
             feed_url: URL del feed RSS
+            cached_items: Noticias obtenidas de este feed en la última actualización
 
         Returns:
             Lista de noticias con título, descripción, link y fecha
         """
         news_items = []
+        feed_meta = self.news_cache.setdefault("feed_meta", {})
 
         try:
             logger.info(f"Consultando feed RSS: {feed_url}")
-            feed = feedparser.parse(feed_url)
+            headers = {}
+            validators = feed_meta.get(feed_url, {})
+            if cached_items:
+                if validators.get("etag"):
+                    headers["If-None-Match"] = validators["etag"]
+                if validators.get("last_modified"):
+                    headers["If-Modified-Since"] = validators["last_modified"]
+
+            # Descargar con requests (timeout y conexiones reutilizadas) y
+            # entregar los bytes al parser junto con las cabeceras HTTP: el
+            # charset de Content-Type y la URL final (Content-Location, para
+            # resolver enlaces relativos) no van dentro de los bytes
+            response = _http_session.get(feed_url, headers=headers, timeout=FEED_TIMEOUT)
+            if response.status_code == 304:
+                logger.info(f"Feed sin cambios, se reutilizan {len(cached_items)} noticias: {feed_url}")
+                return cached_items
+            response.raise_for_status()
+            # feedparser busca las cabeceras en minúsculas
+            response_headers = {name.lower(): value for name, value in response.headers.items()}
+            response_headers.setdefault("content-location", response.url)
+            feed = feedparser.parse(response.content, response_headers=response_headers)
+
+            feed_meta[feed_url] = {
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified")
+            }
 
             if feed.bozo:
                 logger.warning(f"Error al parsear feed {feed_url}: {feed.bozo_exception}")
 
-            for entry in feed.entries[:10]:  # Tomar las 10 noticias más recientes
+            # Un único objeto para la fuente, compartido por todas las noticias del feed
+            source = feed.feed.get("title", feed_url)
+
+            for entry in feed.entries[:MAX_ENTRIES_PER_FEED]:  # Tomar las noticias más recientes
                 news_item = {
                     "title": entry.get("title", "Sin título"),
                     "description": entry.get("summary", entry.get("description", "")),
                     "link": entry.get("link", ""),
                     "published": entry.get("published", entry.get("updated", "")),
-                    "source": feed.feed.get("title", feed_url)
+                    "source": source,
+                    "feed_url": feed_url
                 }
 
                 # Limpiar HTML de la descripción si existe
                 if news_item["description"]:
-                    # Remover etiquetas HTML básicas
-                    import re
-                    news_item["description"] = re.sub(r'<[^>]+>', '', news_item["description"])
+                    # Remover etiquetas HTML básicas (solo si parece haber alguna)
+                    if '<' in news_item["description"]:
+                        news_item["description"] = _HTML_TAG_RE.sub('', news_item["description"])
                     # Limitar longitud de descripción
                     if len(news_item["description"]) > 500:
                         news_item["description"] = news_item["description"][:497] + "..."
@@ -123,6 +210,13 @@ class NewsManager:
         Returns:
             True si se actualizó correctamente, False en caso contrario
         """
+        # Se llama desde hilos (asyncio.to_thread); solo uno actualiza a la vez
+        # y los demás ven el caché ya renovado al obtener el lock
+        with self._update_lock:
+            return self._update_news()
+
+    def _update_news(self) -> bool:
+        """Actualiza el caché de noticias; requiere tener _update_lock."""
         if not self._should_update():
             logger.info("El caché de noticias está actualizado, no es necesario consultar")
             return True
@@ -130,13 +224,28 @@ class NewsManager:
         logger.info("Actualizando caché de noticias...")
         all_news = []
 
-        for feed_url in self.rss_feeds:
-            news_items = self._parse_feed(feed_url)
-            all_news.extend(news_items)
+        # Descargar los feeds en paralelo: el tiempo total pasa a ser el del
+        # feed más lento en lugar de la suma de todos. map conserva el orden.
+        if self.rss_feeds:
+            # Noticias actuales agrupadas por feed, para las peticiones condicionales
+            cached_by_feed = {}
+            for news in self.news_cache.get("news", []):
+                cached_by_feed.setdefault(news.get("feed_url"), []).append(news)
+            # Descartar los validadores de feeds que ya no están configurados
+            old_meta = self.news_cache.get("feed_meta", {})
+            self.news_cache["feed_meta"] = {url: old_meta[url] for url in self.rss_feeds if url in old_meta}
+
+            cached_items = [cached_by_feed.get(url) for url in self.rss_feeds]
+            workers = min(MAX_FEED_WORKERS, len(self.rss_feeds))
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="news") as executor:
+                for news_items in executor.map(self._parse_feed, self.rss_feeds, cached_items):
+                    all_news.extend(news_items)
 
         if all_news:
             self.news_cache["news"] = all_news
             self.news_cache["last_update"] = datetime.now().isoformat()
+            self._next_update = time.monotonic() + UPDATE_INTERVAL
+            self._reshuffle()
             self._save_cache()
             logger.info(f"Caché actualizado con {len(all_news)} noticias")
             return True
@@ -151,16 +260,19 @@ class NewsManager:
         Returns:
             Diccionario con la noticia o None si no hay noticias disponibles
         """
-        # Intentar actualizar si es necesario
-        self.update_news()
-
-        news_list = self.news_cache.get("news", [])
+        # Intentar actualizar solo si toca: evita la llamada completa (y su
+        # mensaje de log) en cada petición de noticia
+        if self._should_update():
+            self.update_news()
 
-        if not news_list:
+        if not self._shuffled_news:
             logger.warning("No hay noticias disponibles en el caché")
             return None
 
-        return random.choice(news_list)
+        # Rotar la ronda barajada: no se repite una noticia hasta agotarlas
+        news = self._shuffled_news.popleft()
+        self._shuffled_news.append(news)
+        return news
 
     def format_news_for_conversation(self, news: Dict) -> str:
         """
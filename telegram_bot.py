@@ -3,9 +3,14 @@ Bot de Telegram que actúa como compañero conversacional.
 """
 import json
 import logging
+import os
 import random
 import asyncio
-from datetime import datetime, timedelta
+import time
+from collections import defaultdict
+from datetime import datetime
+from pathlib import Path
+import orjson
 from telegram import Update
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
 
@@ -20,6 +25,35 @@ from config_reloader import ConfigReloader
 # Logger específico para Telegram (se inicializará después de cargar config)
 logger = None
 
+# Textos fijos de los comandos
+WELCOME_TEMPLATE = (
+    "¡Hola {name}! 👋\n\n"
+    "Soy tu compañero de conversación. Estoy aquí para charlar contigo, "
+    "escuchar tus historias y acompañarte. Puedes hablarme de lo que quieras: "
+    "tus recuerdos, tu día a día, tus intereses... ¡Lo que te apetezca!\n\n"
+    "Escribe cualquier mensaje para empezar a conversar.\n\n"
+    "Comandos disponibles:\n"
+    "/help - Mostrar esta ayuda\n"
+    "/reset - Empezar una nueva conversación"
+)
+
+HELP_MESSAGE = (
+    "🤝 *Cómo usar el bot*\n\n"
+    "Simplemente escribe lo que quieras contarme y yo te responderé. "
+    "Puedo recordar nuestra conversación, así que puedes hacer referencia "
+    "a cosas que me hayas contado antes.\n\n"
+    "*Comandos disponibles:*\n"
+    "/start - Mensaje de bienvenida\n"
+    "/help - Mostrar esta ayuda\n"
+    "/reset - Borrar el historial y empezar de nuevo\n\n"
+    "Estoy aquí para acompañarte y conversar. ¡No dudes en escribirme!"
+)
+
+RESET_MESSAGE = (
+    "✨ He borrado nuestro historial de conversación.\n\n"
+    "Podemos empezar de nuevo. ¿De qué te gustaría hablar?"
+)
+
 
 class CompanionBot:
     """Bot de Telegram que funciona como compañero conversacional."""
@@ -32,8 +66,7 @@ class CompanionBot:
             config_file: Ruta al archivo de configuración
         """
         # Cargar configuración
-        with open(config_file, 'r', encoding='utf-8') as f:
-            self.config = json.load(f)
+        self.config = json.loads(Path(config_file).read_bytes())
 
         # Configurar sistema de logging
         global logger
@@ -50,7 +83,9 @@ class CompanionBot:
         # Inicializar componentes
         self.conversation_manager = ConversationManager(
             conversations_dir=self.config["storage"]["conversations_dir"],
-            max_context_messages=self.config["storage"]["max_context_messages"]
+            max_context_messages=self.config["storage"]["max_context_messages"],
+            flush_every=self.config["storage"].get("flush_every_messages", 10),
+            max_context_chars=self.config["storage"].get("max_context_chars", 0)
         )
 
         self.llm_client = LLMClient(
@@ -59,7 +94,10 @@ class CompanionBot:
             max_tokens=self.config["llm"]["max_tokens"],
             temperature=self.config["llm"]["temperature"],
             system_prompt=self.config["llm"]["system_prompt"],
-            api_url=self.config["llm"]["api_url"]
+            api_url=self.config["llm"]["api_url"],
+            cache_size=self.config["llm"].get("response_cache_size", 128),
+            max_concurrency=self.config["llm"].get("max_concurrent_requests", 4),
+            max_retries=self.config["llm"].get("max_retries", 3)
         )
 
         # Inicializar gestor de noticias si está configurado
@@ -97,21 +135,124 @@ class CompanionBot:
             self.tts_frequency = 0
             logger.info("Cliente TTS deshabilitado")
 
-        # Crear aplicación de Telegram
+        # Crear aplicación de Telegram. Los mensajes de distintos usuarios se
+        # atienden en paralelo para que la espera de uno no retrase a los demás
         self.app = Application.builder().token(
             self.config["telegram"]["bot_token"]
-        ).build()
+        ).concurrent_updates(True).post_init(self.on_startup).post_shutdown(self.on_shutdown).build()
+
+        # Horario de "no molestar" ya interpretado (None si está deshabilitado)
+        self.quiet_hours = self.parse_quiet_hours(self.config)
+
+        # Última actividad de cada usuario (time.monotonic(), inmune a
+        # cambios de hora del sistema). Cada actualización mueve al usuario al
+        # final, así que el diccionario queda ordenado de más antiguo a más
+        # reciente y basta recorrerlo hasta el primer usuario activo.
+        # Se guarda en disco para no perderla al reiniciar el bot
+        self.activity_file = Path(self.config["storage"].get("activity_file", "./user_activity.json"))
+        self.user_last_activity = self._load_activity()
+        self._activity_dirty = False
 
-        # Diccionario para rastrear la última actividad de cada usuario
-        self.user_last_activity = {}
+        # Un lock por usuario para responder a sus mensajes en orden
+        self.user_locks = defaultdict(asyncio.Lock)
+        # Evita recalcular el mood varias veces a la vez
+        self._mood_lock = asyncio.Lock()
 
         # Inicializar reloader de configuración
         self.config_reloader = ConfigReloader(config_file)
+        self._reload_task = None
         logger.info("Sistema de recarga de configuración inicializado")
 
         # Registrar manejadores
         self._register_handlers()
 
+    @staticmethod
+    def parse_quiet_hours(config: dict):
+        """
+        Interpreta el horario de "no molestar" de la configuración.
+
+        Args:
+            config: Configuración completa del bot
+
+        Returns:
+            Tupla (inicio, fin) como objetos time, o None si está deshabilitado
+        """
+        quiet_hours = config.get("proactive", {}).get("quiet_hours", {})
+        if not quiet_hours.get("enabled", False):
+            return None
+        start_time = datetime.strptime(quiet_hours.get("start", "22:00"), "%H:%M").time()
+        end_time = datetime.strptime(quiet_hours.get("end", "09:00"), "%H:%M").time()
+        return start_time, end_time
+
+    def _mark_activity(self, user_id: int):
+        """
+        Registra la actividad de un usuario ahora mismo.
+
+        Args:
+            user_id: ID del usuario de Telegram
+        """
+        self.user_last_activity.pop(user_id, None)
+        self.user_last_activity[user_id] = time.monotonic()
+        self._activity_dirty = True
+
+    def _load_activity(self) -> dict:
+        """
+        Carga la última actividad de los usuarios guardada en disco.
+
+        En disco se guarda la hora real (time.time()) y aquí se convierte a
+        time.monotonic(), que no sobrevive a un reinicio.
+
+        Returns:
+            Diccionario user_id -> última actividad, de más antigua a más reciente
+        """
+        if not self.activity_file.exists():
+            return {}
+
+        try:
+            saved = orjson.loads(self.activity_file.read_bytes())
+            activity = sorted((float(timestamp), int(user_id)) for user_id, timestamp in saved.items())
+        except Exception as e:
+            logger.warning(f"No se pudo cargar la actividad de usuarios de {self.activity_file}, "
+                           f"se empieza sin ella: {e}")
+            return {}
+
+        offset = time.monotonic() - time.time()
+        logger.info(f"Actividad de {len(activity)} usuarios cargada desde {self.activity_file}")
+        return {user_id: timestamp + offset for timestamp, user_id in activity}
+
+    def _save_activity(self):
+        """Guarda en disco la última actividad de los usuarios si ha cambiado."""
+        if not self._activity_dirty:
+            return
+
+        offset = time.time() - time.monotonic()
+        data = {user_id: timestamp + offset for user_id, timestamp in self.user_last_activity.items()}
+        try:
+            # Escribir en un temporal y renombrar para no dejar el archivo a medias
+            tmp_file = self.activity_file.with_name(self.activity_file.name + '.tmp')
+            tmp_file.write_bytes(orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS))
+            os.replace(tmp_file, self.activity_file)
+            self._activity_dirty = False
+        except Exception as e:
+            logger.error(f"Error al guardar la actividad de usuarios: {e}")
+
+    def _inactive_users(self, cutoff: float) -> list:
+        """
+        Obtiene los usuarios cuya última actividad es anterior al corte.
+
+        Args:
+            cutoff: Instante límite de actividad (time.monotonic())
+
+        Returns:
+            Lista de tuplas (user_id, última actividad) de usuarios inactivos
+        """
+        inactive = []
+        for user_id, last_activity in self.user_last_activity.items():
+            if last_activity > cutoff:
+                break
+            inactive.append((user_id, last_activity))
+        return inactive
+
     def _calculate_typing_delay(self, text: str) -> float:
         """
         Calcula un retraso aleatorio basado en la longitud del texto.
@@ -140,6 +281,70 @@ class CompanionBot:
 
         return total_delay
 
+    async def _get_mood(self):
+        """
+        Obtiene el mood actual y su prompt sin bloquear el bucle de eventos.
+
+        Recalcular el mood consulta la API del clima de forma síncrona, así
+        que cuando toca (cada 6 horas) se hace en un hilo aparte.
+
+        Returns:
+            Tupla (mood actual, prompt del mood para el LLM)
+        """
+        if self.mood_manager.should_update():
+            async with self._mood_lock:
+                if self.mood_manager.should_update():
+                    await asyncio.to_thread(self.mood_manager.calculate_mood)
+        return self.mood_manager.current_mood, self.mood_manager.get_mood_prompt()
+
+    async def _keep_typing(self, chat_id: int):
+        """
+        Mantiene el indicador de "escribiendo..." hasta que se cancele.
+        El indicador dura 5 segundos, así que se renueva cada 4.
+
+        Args:
+            chat_id: ID del chat
+        """
+        while True:
+            try:
+                await self.app.bot.send_chat_action(chat_id=chat_id, action="typing")
+            except Exception as e:
+                logger.debug(f"No se pudo enviar el indicador de escritura a {chat_id}: {e}")
+            await asyncio.sleep(4)
+
+    async def _generate_reply(self, chat_id: int, messages: list, mood_prompt: str) -> str:
+        """
+        Obtiene la respuesta del LLM mostrando "escribiendo..." desde el principio.
+
+        El tiempo que tarda el LLM cuenta como parte del retraso simulado de
+        escritura, así que solo se espera lo que falte para completarlo.
+
+        Args:
+            chat_id: ID del chat al que se responde
+            messages: Mensajes de contexto para el LLM
+            mood_prompt: Contexto del estado de ánimo
+
+        Returns:
+            Respuesta generada por el LLM
+        """
+        loop = asyncio.get_running_loop()
+        start_time = loop.time()
+        typing_task = asyncio.create_task(self._keep_typing(chat_id))
+        try:
+            assistant_response = await self.llm_client.aget_response(messages, mood_prompt)
+
+            # Calcular retraso basado en la longitud de la respuesta
+            typing_delay = self._calculate_typing_delay(assistant_response)
+            remaining_time = typing_delay - (loop.time() - start_time)
+            logger.info(f"Esperando {max(remaining_time, 0):.2f} segundos antes de responder a {chat_id} "
+                        f"(retraso simulado: {typing_delay:.2f} segundos)")
+            if remaining_time > 0:
+                await asyncio.sleep(remaining_time)
+        finally:
+            typing_task.cancel()
+
+        return assistant_response
+
     def _register_handlers(self):
         """Registra los manejadores de comandos y mensajes."""
         self.app.add_handler(CommandHandler("start", self.start_command))
@@ -155,21 +360,10 @@ class CompanionBot:
         user = update.effective_user
         logger.info(f"Comando /start recibido de usuario {user.id} ({user.username}, {user.first_name})")
 
-        welcome_message = (
-            f"¡Hola {user.first_name}! 👋\n\n"
-            "Soy tu compañero de conversación. Estoy aquí para charlar contigo, "
-            "escuchar tus historias y acompañarte. Puedes hablarme de lo que quieras: "
-            "tus recuerdos, tu día a día, tus intereses... ¡Lo que te apetezca!\n\n"
-            "Escribe cualquier mensaje para empezar a conversar.\n\n"
-            "Comandos disponibles:\n"
-            "/help - Mostrar esta ayuda\n"
-            "/reset - Empezar una nueva conversación"
-        )
-
-        await update.message.reply_text(welcome_message)
+        await update.message.reply_text(WELCOME_TEMPLATE.format(name=user.first_name))
 
         # Actualizar última actividad
-        self.user_last_activity[user.id] = datetime.now()
+        self._mark_activity(user.id)
 
         logger.info(f"Mensaje de bienvenida enviado a usuario {user.id}")
 
@@ -178,33 +372,19 @@ class CompanionBot:
         user = update.effective_user
         logger.info(f"Comando /help recibido de usuario {user.id}")
 
-        help_message = (
-            "🤝 *Cómo usar el bot*\n\n"
-            "Simplemente escribe lo que quieras contarme y yo te responderé. "
-            "Puedo recordar nuestra conversación, así que puedes hacer referencia "
-            "a cosas que me hayas contado antes.\n\n"
-            "*Comandos disponibles:*\n"
-            "/start - Mensaje de bienvenida\n"
-            "/help - Mostrar esta ayuda\n"
-            "/reset - Borrar el historial y empezar de nuevo\n\n"
-            "Estoy aquí para acompañarte y conversar. ¡No dudes en escribirme!"
-        )
-
-        await update.message.reply_text(help_message, parse_mode='Markdown')
+        await update.message.reply_text(HELP_MESSAGE, parse_mode='Markdown')
 
     async def reset_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Maneja el comando /reset para borrar el historial."""
         user_id = update.effective_user.id
         logger.info(f"Comando /reset recibido de usuario {user_id}")
 
-        self.conversation_manager.clear_user_history(user_id)
+        # Esperar a que termine una respuesta en curso para que no vuelva a
+        # crear el historial con un turno del asistente huérfano
+        async with self.user_locks[user_id]:
+            self.conversation_manager.clear_user_history(user_id)
 
-        reset_message = (
-            "✨ He borrado nuestro historial de conversación.\n\n"
-            "Podemos empezar de nuevo. ¿De qué te gustaría hablar?"
-        )
-
-        await update.message.reply_text(reset_message)
+        await update.message.reply_text(RESET_MESSAGE)
         logger.info(f"Historial de conversación borrado para usuario {user_id}")
 
     async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -215,82 +395,72 @@ class CompanionBot:
         logger.info(f"Mensaje recibido de usuario {user.id} ({user.username}): '{user_message[:100]}...'")
 
         # Actualizar última actividad
-        self.user_last_activity[user.id] = datetime.now()
-        logger.debug(f"Última actividad actualizada para usuario {user.id}")
-
-        # Guardar mensaje del usuario
-        self.conversation_manager.add_message(
-            user_id=user.id,
-            role="user",
-            content=user_message,
-            username=user.username or "",
-            first_name=user.first_name or ""
-        )
-        logger.debug(f"Mensaje de usuario guardado en conversación {user.id}")
-
-        # Obtener contexto de la conversación
-        context_messages = self.conversation_manager.get_context(user.id)
-        logger.debug(f"Contexto obtenido: {len(context_messages)} mensajes")
-
-        # Obtener mood actual
-        current_mood = self.mood_manager.get_current_mood()
-        mood_prompt = self.mood_manager.get_mood_prompt()
-        logger.debug(f"Mood actual: {current_mood.get('base_mood', 'N/A')}")
-
-        # Obtener respuesta del LLM con el mood actual
-        logger.debug(f"Solicitando respuesta al LLM para usuario {user.id}")
-        assistant_response = self.llm_client.get_response(context_messages, mood_prompt)
-
-        # Calcular retraso basado en la longitud de la respuesta
-        typing_delay = self._calculate_typing_delay(assistant_response)
-        logger.info(f"Esperando {typing_delay:.2f} segundos antes de responder a {user.id}")
-
-        # Mostrar indicador de "escribiendo..." durante el retraso
-        # El indicador dura 5 segundos, así que lo renovamos si es necesario
-        start_time = asyncio.get_event_loop().time()
-        while (asyncio.get_event_loop().time() - start_time) < typing_delay:
-            await update.message.chat.send_action(action="typing")
-            # Esperar 4 segundos o el tiempo restante, lo que sea menor
-            remaining_time = typing_delay - (asyncio.get_event_loop().time() - start_time)
-            await asyncio.sleep(min(4, remaining_time))
-
-        # Guardar respuesta del asistente con información de mood
-        self.conversation_manager.add_message(
-            user_id=user.id,
-            role="assistant",
-            content=assistant_response,
-            mood_info=current_mood
-        )
+        self._mark_activity(user.id)
+        logger.debug("Última actividad actualizada para usuario %s", user.id)
+
+        # Procesar los mensajes de un mismo usuario de uno en uno
+        async with self.user_locks[user.id]:
+            # Guardar mensaje del usuario
+            self.conversation_manager.add_message(
+                user_id=user.id,
+                role="user",
+                content=user_message,
+                username=user.username or "",
+                first_name=user.first_name or ""
+            )
+            logger.debug("Mensaje de usuario guardado en conversación %s", user.id)
+
+            # Obtener contexto de la conversación
+            context_messages = self.conversation_manager.get_context(user.id)
+            logger.debug("Contexto obtenido: %d mensajes", len(context_messages))
+
+            # Obtener mood actual
+            current_mood, mood_prompt = await self._get_mood()
+            logger.debug("Mood actual: %s", current_mood.get('base_mood', 'N/A'))
+
+            # Obtener respuesta del LLM con el mood actual, mostrando "escribiendo..."
+            logger.debug("Solicitando respuesta al LLM para usuario %s", user.id)
+            assistant_response = await self._generate_reply(
+                update.effective_chat.id, context_messages, mood_prompt
+            )
+
+            # Guardar respuesta del asistente con información de mood
+            self.conversation_manager.add_message(
+                user_id=user.id,
+                role="assistant",
+                content=assistant_response,
+                mood_info=current_mood
+            )
 
-        # Decidir si enviar con voz según la frecuencia configurada
-        send_audio = False
-        if self.tts_client and self.tts_frequency > 0:
-            # Generar número aleatorio entre 0 y 100
-            random_value = random.randint(0, 100)
-            send_audio = random_value < self.tts_frequency
-            logger.debug(f"Decisión de audio: {random_value} < {self.tts_frequency} = {send_audio}")
-
-        # Enviar respuesta al usuario (con o sin audio)
-        if send_audio:
-            logger.info(f"Generando audio de voz para usuario {user.id}")
-            pcm_data = self.tts_client.generate_audio(assistant_response)
-
-            if pcm_data:
-                # Convertir PCM a WAV con headers correctos
-                wav_data = self.tts_client.pcm_to_wav(pcm_data)
-
-                # Enviar audio
-                await update.message.reply_voice(voice=wav_data)
-                logger.info(f"Audio WAV enviado a usuario {user.id} (tamaño PCM: {len(pcm_data)} bytes, WAV: {len(wav_data)} bytes)")
+            # Decidir si enviar con voz según la frecuencia configurada
+            send_audio = False
+            if self.tts_client and self.tts_frequency > 0:
+                # Generar número aleatorio entre 0 y 100
+                random_value = random.randint(0, 100)
+                send_audio = random_value < self.tts_frequency
+                logger.debug("Decisión de audio: %d < %d = %s", random_value, self.tts_frequency, send_audio)
+
+            # Enviar respuesta al usuario (con o sin audio)
+            if send_audio:
+                logger.info(f"Generando audio de voz para usuario {user.id}")
+                pcm_data = await asyncio.to_thread(self.tts_client.generate_audio, assistant_response)
+
+                if pcm_data:
+                    # Convertir PCM a WAV con headers correctos
+                    wav_data = self.tts_client.pcm_to_wav(pcm_data)
+
+                    # Enviar audio
+                    await update.message.reply_voice(voice=wav_data)
+                    logger.info(f"Audio WAV enviado a usuario {user.id} (tamaño PCM: {len(pcm_data)} bytes, WAV: {len(wav_data)} bytes)")
+                else:
+                    # Si falla la generación de audio, enviar texto
+                    logger.warning(f"Error al generar audio para usuario {user.id}, enviando texto")
+                    await update.message.reply_text(assistant_response)
             else:
-                # Si falla la generación de audio, enviar texto
-                logger.warning(f"Error al generar audio para usuario {user.id}, enviando texto")
+                # Enviar solo texto
                 await update.message.reply_text(assistant_response)
-        else:
-            # Enviar solo texto
-            await update.message.reply_text(assistant_response)
 
-        logger.info(f"Respuesta enviada a usuario {user.id} (longitud: {len(assistant_response)} caracteres, audio: {send_audio})")
+            logger.info(f"Respuesta enviada a usuario {user.id} (longitud: {len(assistant_response)} caracteres, audio: {send_audio})")
 
     async def send_proactive_message(self, context: ContextTypes.DEFAULT_TYPE):
         """
@@ -299,11 +469,9 @@ class CompanionBot:
         logger.debug("Verificando usuarios para mensajes proactivos")
 
         # Verificar horario de "no molestar"
-        quiet_hours = self.config.get("proactive", {}).get("quiet_hours", {})
-        if quiet_hours.get("enabled", False):
+        if self.quiet_hours:
             current_time = datetime.now().time()
-            start_time = datetime.strptime(quiet_hours.get("start", "22:00"), "%H:%M").time()
-            end_time = datetime.strptime(quiet_hours.get("end", "09:00"), "%H:%M").time()
+            start_time, end_time = self.quiet_hours
 
             # Verificar si estamos en horario de no molestar
             if start_time < end_time:
@@ -314,120 +482,131 @@ class CompanionBot:
                 in_quiet_hours = current_time >= start_time or current_time <= end_time
 
             if in_quiet_hours:
-                logger.info(f"Horario de no molestar activo ({quiet_hours.get('start')} - {quiet_hours.get('end')}). No se envían mensajes proactivos.")
+                logger.info(f"Horario de no molestar activo ({start_time:%H:%M} - {end_time:%H:%M}). No se envían mensajes proactivos.")
                 return
 
         # Configuración de tiempo de inactividad (en minutos)
         inactivity_threshold = self.config.get("proactive", {}).get("inactivity_minutes", 60)
 
-        now = datetime.now()
-        users_to_check = list(self.user_last_activity.items())
+        now = time.monotonic()
+        inactive_users = self._inactive_users(now - inactivity_threshold * 60)
+
+        # Atender a todos los usuarios inactivos a la vez: el tiempo total es el
+        # de la respuesta más lenta y no la suma. El semáforo del cliente LLM
+        # limita las peticiones simultáneas a la API
+        await asyncio.gather(*(
+            self._send_proactive_to_user(context, user_id, last_activity, now)
+            for user_id, last_activity in inactive_users
+        ))
+
+    async def _send_proactive_to_user(self, context: ContextTypes.DEFAULT_TYPE, user_id: int,
+                                      last_activity: float, now: float):
+        """
+        Genera y envía un mensaje proactivo a un usuario inactivo.
+
+        Args:
+            context: Contexto del trabajo programado
+            user_id: ID del usuario de Telegram
+            last_activity: Última actividad registrada del usuario (time.monotonic())
+            now: Instante de la comprobación (time.monotonic())
+        """
+        # Compartir el lock con handle_message para no cruzarse con una respuesta
+        async with self.user_locks[user_id]:
+            # Si escribió mientras esperábamos el lock, ya no está inactivo
+            if self.user_last_activity.get(user_id) != last_activity:
+                return
 
-        for user_id, last_activity in users_to_check:
             # Calcular tiempo de inactividad
-            time_inactive = (now - last_activity).total_seconds() / 60
-
-            if time_inactive >= inactivity_threshold:
-                logger.info(f"Usuario {user_id} inactivo por {time_inactive:.1f} minutos. Enviando mensaje proactivo...")
-                try:
-                    # Obtener contexto de la conversación
-                    context_messages = self.conversation_manager.get_context(user_id)
-
-                    # Decidir si usar una noticia (50% de probabilidad si hay noticias disponibles)
-                    use_news = False
-                    news_context = ""
-
-                    if self.news_manager and random.random() < 0.5:
-                        news_item = self.news_manager.get_random_news()
-                        if news_item:
-                            use_news = True
-                            logger.debug(f"Usando noticia en mensaje proactivo: {news_item['title'][:50]}...")
-                            news_context = f"\n\nNOTICIA RECIENTE:\nTítulo: {news_item['title']}\n"
-                            if news_item.get('description'):
-                                news_context += f"Resumen: {news_item['description']}\n"
-                            if news_item.get('source'):
-                                news_context += f"Fuente: {news_item['source']}\n"
-
-                    # Crear un prompt especial para mensaje proactivo
-                    if use_news:
-                        proactive_content = (
-                            "El usuario lleva un rato sin escribir. Inicia una conversación comentando "
-                            "la siguiente noticia de forma natural y amigable. Menciona lo que te parece "
-                            "interesante o pregunta su opinión al respecto. No copies el texto literal, "
-                            "sino comenta sobre ella de manera conversacional." + news_context
-                        )
-                    else:
-                        proactive_content = (
-                            "El usuario lleva un rato sin escribir. Inicia una conversación de forma "
-                            "natural y amigable. Puedes preguntar cómo está, proponer un tema interesante "
-                            "para conversar, compartir algo curioso, o simplemente saludar de manera cálida. "
-                            "Sé creativa y espontánea."
-                        )
-
-                    proactive_prompt = {
-                        "role": "user",
-                        "content": proactive_content
-                    }
-
-                    # Obtener mood actual
-                    current_mood = self.mood_manager.get_current_mood()
-                    mood_prompt = self.mood_manager.get_mood_prompt()
-
-                    # Generar mensaje proactivo con mood
-                    proactive_messages = context_messages + [proactive_prompt]
-                    assistant_response = self.llm_client.get_response(proactive_messages, mood_prompt)
-
-                    # Calcular retraso basado en la longitud de la respuesta
-                    typing_delay = self._calculate_typing_delay(assistant_response)
-                    logger.info(f"Esperando {typing_delay:.2f} segundos antes de enviar mensaje proactivo a {user_id}")
-
-                    # Mostrar indicador de "escribiendo..." durante el retraso
-                    start_time = asyncio.get_event_loop().time()
-                    while (asyncio.get_event_loop().time() - start_time) < typing_delay:
-                        await context.bot.send_chat_action(chat_id=user_id, action="typing")
-                        # Esperar 4 segundos o el tiempo restante, lo que sea menor
-                        remaining_time = typing_delay - (asyncio.get_event_loop().time() - start_time)
-                        await asyncio.sleep(min(4, remaining_time))
-
-                    # Guardar mensaje del asistente con información de mood
-                    self.conversation_manager.add_message(
-                        user_id=user_id,
-                        role="assistant",
-                        content=assistant_response,
-                        mood_info=current_mood
+            time_inactive = (now - last_activity) / 60
+
+            logger.info(f"Usuario {user_id} inactivo por {time_inactive:.1f} minutos. Enviando mensaje proactivo...")
+            try:
+                # Obtener contexto de la conversación
+                context_messages = self.conversation_manager.get_context(user_id)
+
+                # Decidir si usar una noticia (50% de probabilidad si hay noticias disponibles)
+                use_news = False
+                news_context = ""
+
+                if self.news_manager and random.random() < 0.5:
+                    # Puede descargar los feeds si toca actualizar: fuera del bucle de eventos
+                    news_item = await asyncio.to_thread(self.news_manager.get_random_news)
+                    if news_item:
+                        use_news = True
+                        logger.debug("Usando noticia en mensaje proactivo: %s...", news_item['title'][:50])
+                        news_context = f"\n\nNOTICIA RECIENTE:\nTítulo: {news_item['title']}\n"
+                        if news_item.get('description'):
+                            news_context += f"Resumen: {news_item['description']}\n"
+                        if news_item.get('source'):
+                            news_context += f"Fuente: {news_item['source']}\n"
+
+                # Crear un prompt especial para mensaje proactivo
+                if use_news:
+                    proactive_content = (
+                        "El usuario lleva un rato sin escribir. Inicia una conversación comentando "
+                        "la siguiente noticia de forma natural y amigable. Menciona lo que te parece "
+                        "interesante o pregunta su opinión al respecto. No copies el texto literal, "
+                        "sino comenta sobre ella de manera conversacional." + news_context
+                    )
+                else:
+                    proactive_content = (
+                        "El usuario lleva un rato sin escribir. Inicia una conversación de forma "
+                        "natural y amigable. Puedes preguntar cómo está, proponer un tema interesante "
+                        "para conversar, compartir algo curioso, o simplemente saludar de manera cálida. "
+                        "Sé creativa y espontánea."
                     )
 
-                    # Decidir si enviar con voz según la frecuencia configurada
-                    send_audio = False
-                    if self.tts_client and self.tts_frequency > 0:
-                        random_value = random.randint(0, 100)
-                        send_audio = random_value < self.tts_frequency
-                        logger.debug(f"Decisión de audio (proactivo): {random_value} < {self.tts_frequency} = {send_audio}")
-
-                    # Enviar mensaje proactivo al usuario (con o sin audio)
-                    if send_audio:
-                        logger.info(f"Generando audio de voz para mensaje proactivo a usuario {user_id}")
-                        pcm_data = self.tts_client.generate_audio(assistant_response)
-
-                        if pcm_data:
-                            # Convertir PCM a WAV con headers correctos
-                            wav_data = self.tts_client.pcm_to_wav(pcm_data)
-
-                            await context.bot.send_voice(chat_id=user_id, voice=wav_data)
-                            logger.info(f"Audio WAV proactivo enviado a usuario {user_id} (tamaño PCM: {len(pcm_data)} bytes, WAV: {len(wav_data)} bytes)")
-                        else:
-                            logger.warning(f"Error al generar audio proactivo para usuario {user_id}, enviando texto")
-                            await context.bot.send_message(chat_id=user_id, text=assistant_response)
+                proactive_prompt = {
+                    "role": "user",
+                    "content": proactive_content
+                }
+
+                # Obtener mood actual
+                current_mood, mood_prompt = await self._get_mood()
+
+                # Generar mensaje proactivo con mood
+                proactive_messages = context_messages + [proactive_prompt]
+                assistant_response = await self._generate_reply(user_id, proactive_messages, mood_prompt)
+
+                # Guardar mensaje del asistente con información de mood
+                self.conversation_manager.add_message(
+                    user_id=user_id,
+                    role="assistant",
+                    content=assistant_response,
+                    mood_info=current_mood
+                )
+
+                # Decidir si enviar con voz según la frecuencia configurada
+                send_audio = False
+                if self.tts_client and self.tts_frequency > 0:
+                    random_value = random.randint(0, 100)
+                    send_audio = random_value < self.tts_frequency
+                    logger.debug("Decisión de audio (proactivo): %d < %d = %s", random_value, self.tts_frequency, send_audio)
+
+                # Enviar mensaje proactivo al usuario (con o sin audio)
+                if send_audio:
+                    logger.info(f"Generando audio de voz para mensaje proactivo a usuario {user_id}")
+                    pcm_data = await asyncio.to_thread(self.tts_client.generate_audio, assistant_response)
+
+                    if pcm_data:
+                        # Convertir PCM a WAV con headers correctos
+                        wav_data = self.tts_client.pcm_to_wav(pcm_data)
+
+                        await context.bot.send_voice(chat_id=user_id, voice=wav_data)
+                        logger.info(f"Audio WAV proactivo enviado a usuario {user_id} (tamaño PCM: {len(pcm_data)} bytes, WAV: {len(wav_data)} bytes)")
                     else:
+                        logger.warning(f"Error al generar audio proactivo para usuario {user_id}, enviando texto")
                         await context.bot.send_message(chat_id=user_id, text=assistant_response)
+                else:
+                    await context.bot.send_message(chat_id=user_id, text=assistant_response)
 
-                    # Actualizar última actividad (para no enviar otro mensaje inmediatamente)
-                    self.user_last_activity[user_id] = datetime.now()
+                # Actualizar última actividad (para no enviar otro mensaje inmediatamente)
+                self._mark_activity(user_id)
 
-                    logger.info(f"Mensaje proactivo enviado exitosamente a usuario {user_id} (audio: {send_audio})")
+                logger.info(f"Mensaje proactivo enviado exitosamente a usuario {user_id} (audio: {send_audio})")
 
-                except Exception as e:
-                    logger.error(f"Error al enviar mensaje proactivo a usuario {user_id}: {e}", exc_info=True)
+            except Exception as e:
+                logger.error(f"Error al enviar mensaje proactivo a usuario {user_id}: {e}", exc_info=True)
 
     async def update_news_cache(self, context: ContextTypes.DEFAULT_TYPE):
         """
@@ -436,12 +615,45 @@ class CompanionBot:
         """
         if self.news_manager:
             logger.info("Iniciando actualización de noticias RSS...")
-            success = self.news_manager.update_news()
+            success = await asyncio.to_thread(self.news_manager.update_news)
             if success:
                 logger.info(f"Noticias actualizadas: {self.news_manager.get_news_count()} noticias en caché")
             else:
                 logger.warning("No se pudieron actualizar las noticias")
 
+    async def flush_conversations(self, context: ContextTypes.DEFAULT_TYPE):
+        """
+        Escribe a disco las conversaciones con mensajes pendientes y la
+        última actividad de los usuarios.
+        Se ejecuta periódicamente.
+        """
+        self.conversation_manager.flush_all()
+        self._save_activity()
+        # El fsync puede tardar en tarjetas SD: hacerlo fuera del bucle de eventos
+        await asyncio.to_thread(self.conversation_manager.sync)
+
+    async def on_startup(self, application: Application):
+        """Arranca la espera de señales de recarga cuando se dispone de inotify."""
+        if self.config_reloader.uses_inotify:
+            self._reload_task = asyncio.create_task(self.watch_config_reload())
+
+    async def watch_config_reload(self):
+        """Aplica la recarga de configuración en cuanto llega una señal."""
+        while True:
+            await self.config_reloader.wait_reload()
+            logger.info("Señal de recarga detectada, recargando configuración...")
+            await self.config_reloader.reload_config(self)
+            logger.info("Recarga de configuración completada")
+
+    async def on_shutdown(self, application: Application):
+        """Guarda las conversaciones pendientes al detener el bot."""
+        if self._reload_task:
+            self._reload_task.cancel()
+        logger.info("Guardando conversaciones pendientes antes de salir...")
+        self.conversation_manager.flush_all()
+        self.conversation_manager.sync()
+        self._save_activity()
+
     async def check_config_reload(self, context: ContextTypes.DEFAULT_TYPE):
         """
         Verifica si hay señal de recarga de configuración y la aplica.
@@ -449,7 +661,7 @@ class CompanionBot:
         """
         if self.config_reloader.check_reload_signal():
             logger.info("Señal de recarga detectada, recargando configuración...")
-            self.config_reloader.reload_config(self)
+            await self.config_reloader.reload_config(self)
             logger.info("Recarga de configuración completada")
 
     def run(self):
@@ -487,13 +699,26 @@ class CompanionBot:
         else:
             logger.info("Gestor de noticias no disponible")
 
-        # Configurar job para verificar recarga de configuración
+        # Configurar job para guardar conversaciones pendientes
+        flush_interval = self.config["storage"].get("flush_interval_seconds", 60)
         job_queue.run_repeating(
-            self.check_config_reload,
-            interval=30,  # Cada 30 segundos
-            first=5  # Primera verificación a los 5 segundos de iniciar
+            self.flush_conversations,
+            interval=flush_interval,
+            first=flush_interval
         )
-        logger.info("Verificación de recarga de configuración habilitada (cada 30 segundos)")
+        logger.info(f"Guardado periódico de conversaciones habilitado (cada {flush_interval} segundos)")
+
+        # Configurar la recarga de configuración: por eventos con inotify,
+        # o con un job periódico si no está disponible
+        if self.config_reloader.uses_inotify:
+            logger.info("Recarga de configuración habilitada (vigilancia con inotify)")
+        else:
+            job_queue.run_repeating(
+                self.check_config_reload,
+                interval=30,  # Cada 30 segundos
+                first=5  # Primera verificación a los 5 segundos de iniciar
+            )
+            logger.info("Verificación de recarga de configuración habilitada (cada 30 segundos)")
 
         logger.info("Bot iniciado. Esperando mensajes...")
         logger.info("="*60)
@@ -1,10 +1,11 @@
 """
 Cliente para generación de voz usando la API de Google Gemini.
 """
-from google import genai
 from google.genai import types
 from typing import Optional
 from logger_config import get_logger
+from llm_client import get_genai_client
+import logging
 import os
 import wave
 from datetime import datetime
@@ -51,8 +52,8 @@ class TTSClient:
         """
         logger.info(f"Inicializando TTSClient con modelo: {model}, speaker: {speaker}, temperature: {temperature}")
 
-        # Configurar cliente con API key
-        self.client = genai.Client(api_key=api_key)
+        # Reutilizar el cliente de la API del LLM si usa la misma API key
+        self.client = get_genai_client(api_key)
 
         self.model_name = model
         self.speaker = speaker
@@ -120,15 +121,16 @@ class TTSClient:
             # Verificar que hay audio en la respuesta
             if not response.candidates or not response.candidates[0].content.parts:
                 logger.warning("La respuesta no contiene audio")
-                logger.debug(f"Respuesta completa: {response}")
+                logger.debug("Respuesta completa: %s", response)
                 return None
 
             # Obtener el audio de la respuesta
             part = response.candidates[0].content.parts[0]
 
-            # Depuración: ver qué hay en el part
-            logger.debug(f"Part type: {type(part)}")
-            logger.debug(f"Part attributes: {dir(part)}")
+            # Depuración: ver qué hay en el part (dir() solo con DEBUG activo)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Part type: %s", type(part))
+                logger.debug("Part attributes: %s", dir(part))
 
             if hasattr(part, 'inline_data') and part.inline_data:
                 audio_data = part.inline_data.data
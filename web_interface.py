@@ -3,7 +3,8 @@ Interfaz web para consultar los diálogos del bot.
 """
 import json
 from datetime import datetime, timedelta
-from flask import Flask, render_template, request, jsonify, redirect, url_for, session
+from pathlib import Path
+from flask import Flask, Response, render_template, request, jsonify, redirect, url_for, session
 from functools import wraps
 
 from conversation_manager import ConversationManager
@@ -12,8 +13,7 @@ from config_reloader import create_reload_signal
 
 
 # Cargar configuración
-with open('config.json', 'r', encoding='utf-8') as f:
-    config = json.load(f)
+config = json.loads(Path('config.json').read_bytes())
 
 # Configurar sistema de logging
 loggers = setup_logging(config)
@@ -157,6 +157,20 @@ def api_user_messages(user_id):
     return jsonify(messages)
 
 
+@app.route('/api/user/<int:user_id>/export')
+@login_required
+def api_user_export(user_id):
+    """API para descargar el historial completo de un usuario en JSON."""
+    client_ip = request.remote_addr
+    logger.info(f"Exportación del historial del usuario {user_id} desde {client_ip}")
+
+    return Response(
+        conversation_manager.export_user(user_id),
+        mimetype='application/json',
+        headers={'Content-Disposition': f'attachment; filename=user_{user_id}.json'}
+    )
+
+
 @app.route('/settings', methods=['GET', 'POST'])
 @login_required
 def settings():
@@ -168,8 +182,7 @@ def settings():
 
         try:
             # Cargar configuración actual
-            with open('config.json', 'r', encoding='utf-8') as f:
-                current_config = json.load(f)
+            current_config = json.loads(Path('config.json').read_bytes())
 
             # Actualizar valores desde el formulario
             # LLM